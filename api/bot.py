@@ -0,0 +1,88 @@
+import re
+from typing import Dict, Iterable, Optional, Tuple
+
+from discord.ext.commands import Bot
+from discord.ext.commands.cog import Cog
+from discord.message import Message
+
+
+class PrefixRouter:
+    """
+    Matches the command prefix of a message with a single precompiled regex
+    and maps it to the cog owning that prefix.
+
+    A command prefix like "!pk " is owned by the cog with a prefix it starts with, e.g. "pk".
+    Messages that don't start with the first character of any prefix are rejected
+    without running the regex.
+    """
+
+    def __init__(self, prefixes: Tuple[str, ...]) -> None:
+        self.prefixes = tuple(prefixes)
+        self.leaders = frozenset(prefix[0] for prefix in self.prefixes)
+        # Longest first, so a prefix never loses from a shorter prefix it starts with.
+        self.pattern = re.compile(
+            "|".join(
+                re.escape(prefix)
+                for prefix in sorted(self.prefixes, key=len, reverse=True)
+            )
+        )
+        self.owners: Dict[str, Optional[Cog]] = dict.fromkeys(self.prefixes)
+
+    def set_cogs(self, cogs: Iterable[Cog]):
+        cogs = [cog for cog in cogs if getattr(cog, "prefixes", None)]
+        self.owners = {
+            prefix: next(
+                (
+                    cog
+                    for cog in cogs
+                    if any(prefix[1:].startswith(p) for p in cog.prefixes)
+                ),
+                None,
+            )
+            for prefix in self.prefixes
+        }
+
+    def match(self, content: str) -> Optional[str]:
+        """
+        Return the command prefix the content starts with, or None.
+        """
+        if not content or content[0] not in self.leaders:
+            return None
+        match = self.pattern.match(content)
+        return match.group(0) if match else None
+
+    def get_prefix(self, bot: Bot, message: Message):
+        return self.match(message.content) or self.prefixes
+
+
+class PlopBot(Bot):
+    """
+    A Bot that only parses messages starting with one of its command prefixes
+    and only invokes commands of the cog owning the prefix that was used.
+    Commands of cogs without prefixes can be used with any prefix.
+    """
+
+    def __init__(self, command_prefix: Tuple[str, ...], **options) -> None:
+        self.router = PrefixRouter(command_prefix)
+        super().__init__(command_prefix=self.router.get_prefix, **options)
+
+    def add_cog(self, cog: Cog):
+        super().add_cog(cog)
+        self.router.set_cogs(self.cogs.values())
+
+    def remove_cog(self, name: str):
+        super().remove_cog(name)
+        self.router.set_cogs(self.cogs.values())
+
+    async def process_commands(self, message: Message):
+        if message.author.bot:
+            return
+        prefix = self.router.match(message.content)
+        if prefix is None:
+            return
+
+        ctx = await self.get_context(message)
+        cog = ctx.command.cog if ctx.command is not None else None
+        if getattr(cog, "prefixes", None) and cog is not self.router.owners[prefix]:
+            return
+        await self.invoke(ctx)
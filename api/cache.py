@@ -0,0 +1,77 @@
+"""
+Small in-memory caches shared by the cogs.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    A dict-like cache holding at most `maxsize` entries.
+    When full, the least recently used entry is evicted.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            self.data.move_to_end(key)
+        except KeyError:
+            return default
+        return self.data[key]
+
+    def put(self, key: Hashable, value: Any):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self.data.pop(key, default)
+
+    def clear(self):
+        self.data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class TTLCache(LRUCache):
+    """
+    An LRUCache of which the entries expire `ttl` seconds after they were put.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            self.data.pop(key, None)
+            return default
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        super().put(key, (time.monotonic() + self.ttl, value))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self.data.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
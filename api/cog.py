@@ -1,14 +1,47 @@
-from typing import Optional
+import asyncio
+from typing import Iterable, List, Optional
 from discord.errors import NotFound
 from discord.ext.commands.bot import Bot
 from discord.ext.commands.cog import Cog
 from discord.user import User
 
+from . import metrics
+from .cache import TTLCache
+
+# Users fetched from the API are cached for this many seconds.
+USER_CACHE_TTL = 60 * 60
+USER_CACHE_SIZE = 5000
+# Maximum number of concurrent fetch_user calls made by get_user_names.
+USER_FETCH_CONCURRENCY = 8
+
+# Shared by all cogs, maps user ids to fetched Users or None for unknown users.
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+_NOT_CACHED = object()
+
 
 class PlopCog(Cog):
     def __init__(self, bot: Bot, prefixes: Optional[str] = None) -> None:
         self.bot = bot
         self.prefixes = prefixes
+        if metrics.enabled:
+            self._instrument()
+
+    def _instrument(self):
+        """
+        Time all listeners of this cog and all REST calls of the bot.
+        The listeners are replaced on the instance, before the cog is added to the bot.
+        """
+        for _, method_name in self.__cog_listeners__:
+            setattr(
+                self,
+                method_name,
+                metrics.timed_coroutine(
+                    "listener",
+                    f"{self.__class__.__name__}.{method_name}",
+                    getattr(self, method_name),
+                ),
+            )
+        metrics.instrument_http(self.bot.http)
 
     @Cog.listener()
     async def on_ready(self):
@@ -18,6 +51,9 @@ class PlopCog(Cog):
         """
         Attempts to convert a potential user_id to a User.
         If this fails returns None
+
+        Users that are not in the local user cache are fetched from the API
+        and remembered for USER_CACHE_TTL seconds, including unknown users.
         """
         if len(user_target) >= 17:
             try:
@@ -27,10 +63,13 @@ class PlopCog(Cog):
             else:
                 user: User = self.bot.get_user(user_id)
                 if user is None:
-                    try:
-                        user = await self.bot.fetch_user(user_id)
-                    except NotFound:
-                        return None
+                    user = _user_cache.get(user_id, _NOT_CACHED)
+                    if user is _NOT_CACHED:
+                        try:
+                            user = await self.bot.fetch_user(user_id)
+                        except NotFound:
+                            user = None
+                        _user_cache.put(user_id, user)
                 return user
         return None
 
@@ -46,3 +85,16 @@ class PlopCog(Cog):
         if user is None:
             return user_target
         return user.display_name
+
+    async def get_user_names(self, user_targets: Iterable[str]) -> List[str]:
+        """
+        Same as get_user_name for multiple user id strings at once.
+        Users that need to be fetched are fetched concurrently.
+        """
+        semaphore = asyncio.Semaphore(USER_FETCH_CONCURRENCY)
+
+        async def resolve(user_target: str) -> str:
+            async with semaphore:
+                return await self.get_user_name(user_target)
+
+        return list(await asyncio.gather(*(resolve(u) for u in user_targets)))
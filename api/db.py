@@ -1,7 +1,111 @@
+import asyncio
+import functools
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import metrics
+
+DB_PATH = "plopkoek.db"
+# Class of the connections opened by get_conn, e.g. to wrap them for measurements.
+CONNECTION_FACTORY = sqlite3.Connection
+
+# All database work started from the cogs runs on this single thread,
+# this keeps the event loop free and serializes all writes.
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+
+_local = threading.local()
 
 
 def get_conn():
-    conn = sqlite3.connect("plopkoek.db")
-    conn.row_factory = sqlite3.Row
+    """
+    Return the database connection of the current thread.
+
+    The connection is opened on first use and kept open for the lifetime of the thread,
+    so it should not be closed by callers.
+    It runs in autocommit mode, use `transaction` to group multiple statements.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_PATH,
+            isolation_level=None,
+            cached_statements=256,
+            factory=CONNECTION_FACTORY,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA cache_size=-16000;")
+        conn.execute("PRAGMA mmap_size=268435456;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        conn.execute("PRAGMA busy_timeout=5000;")
+        _local.conn = conn
     return conn
+
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """
+    Run the enclosed statements on the thread's connection in a single transaction.
+    The transaction is committed on success and rolled back if an exception is raised.
+
+    Use `immediate` to take the write lock at the start of the transaction,
+    e.g. when a read decides whether a write may happen.
+    """
+    conn = get_conn()
+    conn.execute("BEGIN IMMEDIATE;" if immediate else "BEGIN;")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+
+
+def timed(func):
+    """
+    Observe the duration of every call of a blocking database function in the "db" histogram,
+    when metrics are enabled.
+    """
+    name = f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not metrics.enabled:
+            return func(*args, **kwargs)
+        with metrics.timer("db", name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def run_in_db_thread(func):
+    """
+    Turn a blocking database function into a coroutine function executed on DB_EXECUTOR.
+    The blocking version stays available as `__wrapped__`.
+
+    When metrics are enabled, the time spent waiting for the DB thread is observed
+    in the "db_wait" histogram and the time spent running in the "db" histogram.
+    """
+    name = f"{func.__module__}.{func.__name__}"
+    timed_func = timed(func)
+
+    def wait_and_run(submitted, *args, **kwargs):
+        metrics.observe("db_wait", name, time.perf_counter() - submitted)
+        return timed_func(*args, **kwargs)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        if metrics.enabled:
+            call = functools.partial(
+                wait_and_run, time.perf_counter(), *args, **kwargs
+            )
+        else:
+            call = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(DB_EXECUTOR, call)
+
+    return wrapper
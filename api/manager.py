@@ -1,9 +1,9 @@
 import sys
 from typing import List
 
-from discord.ext.commands import Bot
-
-from api.utils import get_value
+from api import metrics, watchdog
+from api.bot import PlopBot
+from api.utils import get_data, get_value
 
 prefixes = ("!quotebot ", "!plopkoekbot ", "!qb ", "!pk ")
 if get_value("main", "test_env"):
@@ -11,7 +11,14 @@ if get_value("main", "test_env"):
 
 
 def start_cogs(cogs: List[str]):
-    bot = Bot(command_prefix=prefixes)
+    config = get_data("main")
+    if config.get("metrics"):
+        metrics.enable()
+        if config.get("metrics_port"):
+            metrics.serve(config["metrics_port"])
+
+    bot = PlopBot(command_prefix=prefixes)
+    watchdog.start(bot.loop, config.get("watchdog_threshold", watchdog.LAG_THRESHOLD))
 
     for cog in cogs:
         bot.load_extension(f"cogs.{cog}")
@@ -0,0 +1,184 @@
+"""
+Timing histograms of listeners, commands, database calls and REST calls.
+
+Nothing is measured unless `enable` is called before the cogs are loaded,
+the instrumentation only checks the `enabled` flag when it is disabled.
+The histograms can be served in the Prometheus text format with `serve`.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+# Upper bounds in seconds of the histogram buckets, the last bucket is unbounded.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = "plopkoek_"
+
+enabled = False
+
+_lock = threading.Lock()
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the q-quantile as the upper bound of the bucket it falls in.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# Histograms per (metric, name), e.g. ("command", "leaders").
+_histograms: Dict[Tuple[str, str], Histogram] = {}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def observe(metric: str, name: str, seconds: float):
+    with _lock:
+        histogram = _histograms.get((metric, name))
+        if histogram is None:
+            histogram = _histograms[(metric, name)] = Histogram()
+        histogram.observe(seconds)
+
+
+@contextmanager
+def timer(metric: str, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(metric, name, time.perf_counter() - start)
+
+
+def timed_coroutine(metric: str, name: str, func):
+    """
+    Wrap a coroutine function so every call is observed in the given histogram.
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timer(metric, name):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_http(http):
+    """
+    Time every REST call made through a discord.py HTTPClient, per route.
+    """
+    if getattr(http, "_metrics_instrumented", False):
+        return
+    request = http.request
+
+    async def timed_request(route, **kwargs):
+        with timer("http", f"{route.method} {route.path}"):
+            return await request(route, **kwargs)
+
+    http.request = timed_request
+    http._metrics_instrumented = True
+
+
+def instrument_webhook_adapter(adapter):
+    """
+    Time every request made through a discord.py webhook adapter.
+    """
+    request = adapter.request
+
+    async def timed_request(verb, url, *args, **kwargs):
+        with timer("http", f"{verb} webhook"):
+            return await request(verb, url, *args, **kwargs)
+
+    adapter.request = timed_request
+
+
+def summary() -> List[Tuple[str, str, int, float, float, float]]:
+    """
+    Rows of metric, name, count, total seconds, p50 and p99 seconds,
+    ordered by total time spent, highest first.
+    """
+    with _lock:
+        rows = [
+            (metric, name, h.count, h.sum, h.quantile(0.5), h.quantile(0.99))
+            for (metric, name), h in _histograms.items()
+        ]
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render() -> str:
+    """
+    All histograms in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        items = sorted(_histograms.items())
+        metric = None
+        for (name, label), histogram in items:
+            full_name = f"{METRIC_PREFIX}{name}_seconds"
+            if name != metric:
+                lines.append(f"# TYPE {full_name} histogram")
+                metric = name
+            label = f'name="{_escape(label)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{full_name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{full_name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f"{full_name}_sum{{{label}}} {histogram.sum}")
+            lines.append(f"{full_name}_count{{{label}}} {histogram.count}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve the histograms on http://host:port/metrics from a background thread,
+    so they stay available when the event loop is busy.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
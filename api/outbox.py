@@ -0,0 +1,150 @@
+"""
+Outbound message delivery.
+
+Messages are put on a queue per destination and sent by a background task,
+so cogs don't have to wait for Discord (and its rate limits) in their event handlers.
+Every destination is paced with a token bucket and messages that pile up
+for the same destination are combined into as few messages as possible,
+quoting the embeds of combined messages in their text.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Hashable, List, NamedTuple, Optional
+
+from discord.abc import Messageable
+from discord.embeds import Embed
+from discord.errors import HTTPException
+
+from .cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Discord refuses messages with more than this many characters.
+MAX_MESSAGE_LENGTH = 2000
+# Messages per second sent to a single destination and the allowed burst on top of that.
+SEND_RATE = 1.0
+SEND_BURST = 5
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class _Outgoing(NamedTuple):
+    content: Optional[str]
+    embed: Optional[Embed]
+
+
+def quote_embed(embed: Embed) -> str:
+    """
+    Render the author, title and description of an embed as a quote in markdown.
+    """
+    lines = [f"**{text}**" for text in (embed.author.name, embed.title) if text]
+    if embed.description:
+        lines.extend(embed.description.splitlines())
+    return "\n".join(f"> {line}" for line in lines)
+
+
+def _as_text(message: _Outgoing) -> str:
+    parts = [message.content] if message.content else []
+    if message.embed is not None:
+        parts.append(quote_embed(message.embed))
+    return "\n".join(parts)
+
+
+def coalesce(queue: Deque[_Outgoing]) -> _Outgoing:
+    """
+    Pop the first message from the queue and merge the following messages into it,
+    as long as the result stays within MAX_MESSAGE_LENGTH.
+    When messages are merged, their embeds are quoted in the text right after their content,
+    so every embed stays next to the message it belongs to.
+    """
+    first = queue.popleft()
+    parts: List[str] = [_as_text(first)]
+    length = len(parts[0])
+    while queue:
+        text = _as_text(queue[0])
+        if length + 1 + len(text) > MAX_MESSAGE_LENGTH:
+            break
+        queue.popleft()
+        parts.append(text)
+        length += 1 + len(text)
+    if len(parts) == 1:
+        return first
+    return _Outgoing("\n".join(part for part in parts if part) or None, None)
+
+
+class Outbox:
+    def __init__(self, rate: float = SEND_RATE, burst: int = SEND_BURST) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.queues: Dict[Hashable, Deque[_Outgoing]] = {}
+        self.workers: Dict[Hashable, asyncio.Task] = {}
+        self.buckets = LRUCache(1000)
+
+    def send(
+        self,
+        destination: Messageable,
+        content: Optional[str] = None,
+        embed: Optional[Embed] = None,
+    ):
+        """
+        Queue a message for the destination and return immediately.
+        Raises AttributeError if the destination can't be messaged.
+        """
+        if not hasattr(destination, "send"):
+            raise AttributeError(f"{destination!r} can't be messaged")
+        key = destination.id
+        self.queues.setdefault(key, deque()).append(_Outgoing(content, embed))
+        if key not in self.workers:
+            self.workers[key] = asyncio.get_event_loop().create_task(
+                self._work(key, destination)
+            )
+
+    async def _work(self, key: Hashable, destination: Messageable):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst)
+            self.buckets.put(key, bucket)
+        queue = self.queues[key]
+        try:
+            while queue:
+                await bucket.acquire()
+                message = coalesce(queue)
+                try:
+                    await destination.send(message.content, embed=message.embed)
+                except HTTPException:
+                    logger.exception(f"Could not deliver message to {key}")
+        finally:
+            del self.workers[key]
+            if not queue:
+                del self.queues[key]
+
+    async def drain(self):
+        """
+        Wait until all queued messages have been sent.
+        """
+        while self.workers:
+            await asyncio.gather(*self.workers.values(), return_exceptions=True)
+
+
+outbox = Outbox()
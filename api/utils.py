@@ -1,71 +1,191 @@
 """
 A collection of various utilities.
+
+Config files are loaded once and served from memory afterwards.
+Writes update the in-memory copy immediately and are flushed to disk
+shortly afterwards in a single atomic write (temp file + rename).
+If a config file is changed on disk by something else, it is reloaded on the next read.
 """
+
+import atexit
+import copy
 import json
 import os
+import tempfile
 import threading
+import time
+from typing import Any, Dict, Optional
 
 ROOTDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Directory holding the config files, can be pointed elsewhere before the cogs are imported.
+CONFIG_DIR = os.path.join(ROOTDIR, "config")
 API_VERSION = 6
 
-WRITE_LOCK = threading.Lock()
+WRITE_LOCK = threading.RLock()
+
+# Seconds to wait after a write before flushing it to disk, so bursts of writes end up in one flush.
+FLUSH_DELAY = 1.0
+# Minimum number of seconds between two mtime checks of the same config file.
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+class _ConfigEntry:
+    def __init__(self, data: Any, mtime: float) -> None:
+        self.data = data
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self.dirty = False
+        self.timer: Optional[threading.Timer] = None
+
+
+_CONFIGS: Dict[str, _ConfigEntry] = {}
+
+
+def _get_path(name) -> str:
+    return os.path.join(CONFIG_DIR, name)
 
 
 def has_config(name) -> bool:
-    return os.path.exists(os.path.join(ROOTDIR, "config", name))
+    return os.path.exists(_get_path(name))
 
 
-def get_data(name):
-    """
-    Retrieves the content of the config file for the given name.
-    These config files are supposed to be located in the "config" directory.
-    """
-    cfgpath = os.path.join(ROOTDIR, "config", name)
+def _load(name) -> _ConfigEntry:
+    cfgpath = _get_path(name)
     open(cfgpath, "a").close()  # create cfg file if it doesnt exist
 
     with open(cfgpath, "r") as f:
         data = json.load(f)
 
-    return data
+    entry = _ConfigEntry(data, os.stat(cfgpath).st_mtime)
+    _CONFIGS[name] = entry
+    return entry
+
+
+def _get_entry(name) -> _ConfigEntry:
+    entry = _CONFIGS.get(name)
+    if entry is None:
+        return _load(name)
+    if entry.dirty:
+        # Pending in-memory changes win over whatever is on disk.
+        return entry
+    now = time.monotonic()
+    if now - entry.checked_at >= RELOAD_CHECK_INTERVAL:
+        entry.checked_at = now
+        try:
+            mtime = os.stat(_get_path(name)).st_mtime
+        except FileNotFoundError:
+            return _load(name)
+        if mtime != entry.mtime:
+            return _load(name)
+    return entry
+
+
+def get_data(name):
+    """
+    Retrieves the content of the config file for the given name.
+    These config files are supposed to be located in the "config" directory.
+
+    The returned object is a copy of the in-memory config,
+    changes to it are only kept when passed to `set_data`.
+    """
+    with WRITE_LOCK:
+        return copy.deepcopy(_get_entry(name).data)
 
 
 def set_data(name, data):
-    cfgpath = os.path.join(ROOTDIR, "config", name)
+    """
+    Replace the content of the config file for the given name.
+    The write to disk happens after FLUSH_DELAY seconds.
+    The config keeps a reference to `data`, so it shouldn't be changed afterwards.
+    """
     with WRITE_LOCK:
-        with open(cfgpath, "w") as f:
-            json.dump(data, f, indent=4, sort_keys=True)
+        entry = _CONFIGS.get(name)
+        if entry is None:
+            entry = _ConfigEntry(data, 0)
+            _CONFIGS[name] = entry
+        entry.data = data
+        entry.dirty = True
+        if entry.timer is None:
+            entry.timer = threading.Timer(FLUSH_DELAY, flush, args=(name,))
+            entry.timer.daemon = True
+            entry.timer.start()
+
+
+def flush(name=None):
+    """
+    Write pending changes of the config for `name` to disk.
+    If no name is given, all configs with pending changes are written.
+    """
+    with WRITE_LOCK:
+        names = [name] if name is not None else list(_CONFIGS.keys())
+        for cfg_name in names:
+            entry = _CONFIGS.get(cfg_name)
+            if entry is None:
+                continue
+            if entry.timer is not None:
+                entry.timer.cancel()
+                entry.timer = None
+            if not entry.dirty:
+                continue
+
+            cfgpath = _get_path(cfg_name)
+            fd, tmppath = tempfile.mkstemp(
+                dir=os.path.dirname(cfgpath), prefix=f".{cfg_name}."
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry.data, f, indent=4, sort_keys=True)
+                os.replace(tmppath, cfgpath)
+            except BaseException:
+                os.unlink(tmppath)
+                raise
+            entry.dirty = False
+            entry.mtime = os.stat(cfgpath).st_mtime
+            entry.checked_at = time.monotonic()
+
+
+atexit.register(flush)
 
 
 def get_value(name, var):
     """
     Read the `var` value from the config for `name`.
+    Like `get_data`, a copy is returned.
     """
-    return get_data(name)[var]
+    with WRITE_LOCK:
+        return copy.deepcopy(_get_entry(name).data[var])
 
 
 def set_value(name, var, value):
     """
     Set the `var` value from the config for `name` to `value`.
     """
-    data = get_data(name)
-    data[var] = value
-    set_data(name, data)
+    with WRITE_LOCK:
+        data = _get_entry(name).data
+        data[var] = value
+        set_data(name, data)
+
+
+# The helpers below change the in-memory config in place, they are the only code that may do so.
 
 
 def pop_value(name, var, value):
-    data = get_value(name, var)
-    pop = data.pop(value)
-    set_value(name, var, data)
+    with WRITE_LOCK:
+        data = _get_entry(name).data[var]
+        pop = data.pop(value)
+        set_value(name, var, data)
     return pop
 
 
 def append_value(name, var, value):
-    data = get_value(name, var)
-    data.append(value)
-    set_value(name, var, data)
+    with WRITE_LOCK:
+        data = _get_entry(name).data[var]
+        data.append(value)
+        set_value(name, var, data)
 
 
 def update_value(name, var, key, value):
-    data = get_value(name, var)
-    data[key] = value
-    set_value(name, var, data)
+    with WRITE_LOCK:
+        data = _get_entry(name).data[var]
+        data[key] = value
+        set_value(name, var, data)
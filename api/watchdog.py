@@ -0,0 +1,130 @@
+"""
+Event loop stall detection.
+
+A coroutine on the event loop beats every BEAT_INTERVAL seconds and measures how late it wakes up.
+A background thread checks the beats and, while the loop is late by more than the threshold,
+samples the stack of the loop thread to see what is blocking it.
+The samples are aggregated by call site and logged every REPORT_INTERVAL seconds.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Optional, Tuple
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+BEAT_INTERVAL = 0.1
+# Seconds the loop may be late before its stack is sampled.
+LAG_THRESHOLD = 0.25
+# Seconds between two stack samples of a stalled loop.
+SAMPLE_INTERVAL = 0.05
+REPORT_INTERVAL = 60.0
+# Number of call sites per report and frames per call site.
+REPORT_CALL_SITES = 5
+STACK_DEPTH = 30
+
+_ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+
+CallSite = Tuple[Tuple[str, int, str, Optional[str]], ...]
+
+
+def get_call_site(frame) -> CallSite:
+    """
+    The innermost STACK_DEPTH frames of a stack, without the event loop machinery below the task.
+    """
+    stack = traceback.extract_stack(frame, limit=STACK_DEPTH)
+    for i in range(len(stack) - 1, -1, -1):
+        if stack[i].filename.startswith(_ASYNCIO_DIR):
+            if i + 1 < len(stack):
+                stack = stack[i + 1 :]
+            break
+    return tuple((f.filename, f.lineno, f.name, f.line) for f in stack)
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = LAG_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self.loop_thread: Optional[int] = None
+        self.stopped = threading.Event()
+        # Only touched by the watchdog thread.
+        self.samples: Counter = Counter()
+        self.stalls = 0
+        # Highest lag since the last report, written by the loop thread.
+        self.max_lag = 0.0
+
+    async def beat(self):
+        self.loop_thread = threading.get_ident()
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(BEAT_INTERVAL)
+            lag = time.monotonic() - self.last_beat - BEAT_INTERVAL
+            self.max_lag = max(self.max_lag, lag)
+            if metrics.enabled:
+                metrics.observe("loop_lag", "event loop", lag)
+
+    def watch(self):
+        last_report = time.monotonic()
+        stalled = False
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            now = time.monotonic()
+            if (
+                self.loop_thread is not None
+                and now - self.last_beat > BEAT_INTERVAL + self.threshold
+            ):
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is not None:
+                    self.samples[get_call_site(frame)] += 1
+                    del frame
+                if not stalled:
+                    self.stalls += 1
+                stalled = True
+            else:
+                stalled = False
+            if now - last_report >= REPORT_INTERVAL:
+                self.report(now - last_report)
+                last_report = now
+
+    def report(self, period: float):
+        """
+        Log the call sites that blocked the loop since the last report, most samples first.
+        """
+        if not self.samples:
+            self.max_lag = 0.0
+            return
+        lines = [
+            f"Event loop stalled {self.stalls} times in the last {period:.0f}s, "
+            f"lagging up to {self.max_lag:.2f}s. Blocked at:"
+        ]
+        for call_site, count in self.samples.most_common(REPORT_CALL_SITES):
+            lines.append(f"~{count * SAMPLE_INTERVAL:.2f}s in {count} samples:")
+            lines.append("".join(traceback.format_list(list(call_site))).rstrip())
+        if len(self.samples) > REPORT_CALL_SITES:
+            lines.append(f"and {len(self.samples) - REPORT_CALL_SITES} more call sites")
+        logger.warning("\n".join(lines))
+        self.samples.clear()
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start(
+    loop: asyncio.AbstractEventLoop, threshold: float = LAG_THRESHOLD
+) -> LoopWatchdog:
+    """
+    Watch the given loop, the beat starts as soon as the loop runs.
+    """
+    watchdog = LoopWatchdog(threshold)
+    loop.create_task(watchdog.beat())
+    threading.Thread(target=watchdog.watch, name="loop-watchdog", daemon=True).start()
+    return watchdog
@@ -0,0 +1,7 @@
+"""
+Offline benchmarks of the cogs.
+
+The cogs are driven by synthetic gateway events through a local stand-in for the Discord HTTP API,
+so no bot token or network connection is needed.
+Run `python -m bench --help` for the available scenarios.
+"""
@@ -0,0 +1,152 @@
+"""
+Run the benchmark scenarios against PlopkoekCog and QuoteCog.
+
+e.g. `python -m bench reactions --events 2000`
+
+The cogs run against a throwaway config directory and database,
+so the real config files and plopkoek.db are never touched.
+Scenarios only generate data when the database doesn't have any yet.
+"""
+
+import argparse
+import asyncio
+import random
+import shutil
+import tempfile
+import time
+from datetime import date
+
+from tabulate import tabulate
+
+from api import db, metrics
+
+from .measure import TimedConnection
+from .workspace import setup_workspace
+
+
+def report(name: str, recorder):
+    duration = recorder.finished - recorder.started
+    print(
+        f"== {name}: {sum(map(len, recorder.latencies.values()))} events in {duration:.2f}s =="
+    )
+    print(
+        tabulate(
+            recorder.rows(),
+            headers=["event", "count", "events/s", "p50 ms", "p99 ms", "max ms"],
+            floatfmt=".2f",
+        )
+    )
+    db_seconds = recorder.db_seconds()
+    print(
+        "db time: "
+        + (", ".join(f"{t} {s:.3f}s" for t, s in sorted(db_seconds.items())) or "none")
+    )
+    print(
+        "http calls: "
+        + (
+            ", ".join(f"{r} {c}" for r, c in sorted(recorder.http_calls.items()))
+            or "none"
+        )
+    )
+    print(f"outbox drained in {recorder.drain_seconds:.2f}s after the last handler")
+    print(
+        "errors: "
+        + (", ".join(f"{e} {c}" for e, c in sorted(recorder.errors.items())) or "none")
+    )
+    print()
+
+
+async def run(args):
+    from api.manager import prefixes
+
+    from .fake import BenchBot, World
+    from .scenarios import SCENARIOS
+
+    world = World(args.users)
+    bot = BenchBot(
+        world,
+        args.http_latency / 1000,
+        command_prefix=prefixes,
+        loop=asyncio.get_running_loop(),
+    )
+    bot.load_extension("cogs.plopkoek")
+    bot.load_extension("cogs.quote")
+
+    rng = random.Random(args.seed)
+    for name in args.scenarios or SCENARIOS:
+        scenario = SCENARIOS[name]
+        events = args.events or scenario.events
+        rate = scenario.rate if args.rate is None else args.rate
+        print(f"{name}: {events} events at {f'{rate:.1f}/s' if rate else 'full speed'}")
+        start = time.perf_counter()
+        recorder = await scenario.run(bot, world, rng, events, rate, args.end)
+        print(f"  done in {time.perf_counter() - start:.2f}s including setup")
+        report(name, recorder)
+
+    if metrics.enabled:
+        print(
+            tabulate(
+                [
+                    [metric, name, count, total, p50 * 1000, p99 * 1000]
+                    for metric, name, count, total, p50, p99 in metrics.summary()
+                ],
+                headers=["metric", "name", "calls", "total s", "p50 ms", "p99 ms"],
+                floatfmt=".3f",
+            )
+        )
+
+
+def main():
+    from .scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__)
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        help=f"scenarios to run in order, all of them by default: {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--events", type=int, help="number of events per scenario")
+    parser.add_argument(
+        "--rate", type=float, help="events per second, 0 for as fast as possible"
+    )
+    parser.add_argument(
+        "--http-latency",
+        type=float,
+        default=50,
+        help="milliseconds every API call takes (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--db",
+        help="start from a copy of this database, e.g. one made by bench.generate "
+        "with the same --users",
+    )
+    parser.add_argument(
+        "--end",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="day after the last generated transfer, as YYYY-MM-DD (default: today)",
+    )
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="enable api.metrics and show its summary at the end",
+    )
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}")
+
+    with tempfile.TemporaryDirectory(prefix="plopkoek-bench-") as directory:
+        setup_workspace(directory)
+        if args.db:
+            shutil.copyfile(args.db, db.DB_PATH)
+        db.CONNECTION_FACTORY = TimedConnection
+        if args.metrics:
+            metrics.enable()
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
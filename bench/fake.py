@@ -0,0 +1,244 @@
+"""
+A local stand-in for Discord.
+
+`World` holds the users, channels and messages of a single fake guild and produces the gateway payloads.
+`FakeHTTP` answers the API calls made by discord.py from that world after a simulated latency.
+`BenchBot` is a regular commands Bot that never connects, events are fed to it directly.
+"""
+
+import asyncio
+import itertools
+import traceback
+from collections import Counter
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from discord.errors import NotFound
+from discord.http import Route
+from discord.user import ClientUser
+
+from api.bot import PlopBot
+
+GUILD_ID = 400000000000000000
+BOT_ID = 100000000000000000
+FIRST_CHANNEL_ID = 200000000000000000
+FIRST_MESSAGE_ID = 300000000000000000
+# DM channel ids are the recipient's user id plus this offset.
+DM_CHANNEL_OFFSET = 500000000000000000
+JOINED_AT = "2020-01-01T00:00:00+00:00"
+
+_NOT_FOUND = SimpleNamespace(status=404, reason="Not Found")
+
+
+class World:
+    def __init__(self, users: int, channels: int = 5) -> None:
+        self.user_ids: List[int] = [BOT_ID + 1 + i for i in range(users)]
+        self.known_users = set(self.user_ids) | {BOT_ID}
+        self.channel_ids: List[int] = [FIRST_CHANNEL_ID + i for i in range(channels)]
+        self.messages: Dict[int, dict] = {}
+        self.next_message_id = itertools.count(FIRST_MESSAGE_ID)
+
+    def user_payload(self, user_id: int) -> dict:
+        return {
+            "id": str(user_id),
+            "username": (
+                "plopkoek-bench" if user_id == BOT_ID else f"user{user_id - BOT_ID}"
+            ),
+            "discriminator": "0001",
+            "avatar": None,
+            "bot": user_id == BOT_ID,
+        }
+
+    def member_payload(self, user_id: int) -> dict:
+        return {
+            "user": self.user_payload(user_id),
+            "roles": [],
+            "joined_at": JOINED_AT,
+            "deaf": False,
+            "mute": False,
+        }
+
+    def channel_payload(self, channel_id: int) -> dict:
+        if channel_id >= DM_CHANNEL_OFFSET:
+            return self.dm_channel_payload(channel_id - DM_CHANNEL_OFFSET)
+        return {
+            "id": str(channel_id),
+            "type": 0,
+            "guild_id": str(GUILD_ID),
+            "name": f"channel-{channel_id - FIRST_CHANNEL_ID}",
+            "position": channel_id - FIRST_CHANNEL_ID,
+            "permission_overwrites": [],
+        }
+
+    def dm_channel_payload(self, user_id: int) -> dict:
+        return {
+            "id": str(DM_CHANNEL_OFFSET + user_id),
+            "type": 1,
+            "recipients": [self.user_payload(user_id)],
+            "last_message_id": None,
+        }
+
+    def guild_payload(self) -> dict:
+        return {
+            "id": str(GUILD_ID),
+            "name": "plopkoek",
+            "roles": [],
+            "emojis": [],
+            "members": [],
+            "channels": [self.channel_payload(c) for c in self.channel_ids],
+            "member_count": len(self.user_ids),
+        }
+
+    def message_payload(
+        self,
+        channel_id: int,
+        author_id: int,
+        content: str,
+        embeds: Optional[List[dict]] = None,
+        webhook_id: Optional[int] = None,
+    ) -> dict:
+        """
+        Create a new message in the world and return its payload.
+        """
+        message_id = next(self.next_message_id)
+        data = {
+            "id": str(message_id),
+            "channel_id": str(channel_id),
+            "author": self.user_payload(author_id),
+            "content": content,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": embeds or [],
+            "pinned": False,
+            "type": 0,
+        }
+        if channel_id < DM_CHANNEL_OFFSET:
+            data["guild_id"] = str(GUILD_ID)
+            member = self.member_payload(author_id)
+            del member["user"]
+            data["member"] = member
+        if webhook_id is not None:
+            data["webhook_id"] = str(webhook_id)
+        self.messages[message_id] = data
+        return data
+
+    def reaction_payload(
+        self, message_id: int, user_id: int, emoji_id: int, add: bool = True
+    ) -> dict:
+        data = {
+            "user_id": str(user_id),
+            "channel_id": self.messages[message_id]["channel_id"],
+            "message_id": str(message_id),
+            "guild_id": str(GUILD_ID),
+            "emoji": {"id": str(emoji_id), "name": "emoji"},
+        }
+        if add:
+            data["member"] = self.member_payload(user_id)
+        return data
+
+
+class FakeHTTP:
+    """
+    Serves the discord.py HTTPClient calls used by the cogs from a World.
+    Every call waits `latency` seconds and is counted per route in `calls`.
+    """
+
+    def __init__(self, world: World, latency: float) -> None:
+        self.world = world
+        self.latency = latency
+        self.calls: Counter = Counter()
+
+    async def request(self, route: Route):
+        self.calls[f"{route.method} {route.path}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def get_user(self, user_id):
+        await self.request(Route("GET", "/users/{user_id}"))
+        if int(user_id) not in self.world.known_users:
+            raise NotFound(_NOT_FOUND, "Unknown User")
+        return self.world.user_payload(int(user_id))
+
+    async def get_channel(self, channel_id):
+        await self.request(Route("GET", "/channels/{channel_id}"))
+        return self.world.channel_payload(int(channel_id))
+
+    async def get_message(self, channel_id, message_id):
+        await self.request(Route("GET", "/channels/{channel_id}/messages/{message_id}"))
+        data = self.world.messages.get(int(message_id))
+        if data is None or data["channel_id"] != str(channel_id):
+            raise NotFound(_NOT_FOUND, "Unknown Message")
+        return data
+
+    async def start_private_message(self, user_id):
+        await self.request(Route("POST", "/users/@me/channels"))
+        return self.world.dm_channel_payload(int(user_id))
+
+    async def send_message(self, channel_id, content, *, embed=None, **kwargs):
+        await self.request(Route("POST", "/channels/{channel_id}/messages"))
+        return self.world.message_payload(
+            int(channel_id), BOT_ID, content or "", [embed] if embed else None
+        )
+
+    async def send_files(
+        self, channel_id, *, files, content=None, embed=None, **kwargs
+    ):
+        await self.request(Route("POST", "/channels/{channel_id}/messages"))
+        return self.world.message_payload(
+            int(channel_id), BOT_ID, content or "", [embed] if embed else None
+        )
+
+
+class BenchBot(PlopBot):
+    """
+    A PlopBot that gets its gateway events from `feed` and its API responses from FakeHTTP.
+    Errors in handlers are counted in `errors`, only the first traceback of each kind is printed.
+    """
+
+    def __init__(self, world: World, http_latency: float, **options) -> None:
+        super().__init__(**options)
+        self.world = world
+        self.http = self._connection.http = FakeHTTP(world, http_latency)
+        self._connection.user = ClientUser(
+            state=self._connection, data=world.user_payload(BOT_ID)
+        )
+        self._connection._add_guild_from_data(world.guild_payload())
+        self.errors: Counter = Counter()
+        self._collected: Optional[List[asyncio.Task]] = None
+
+    def _schedule_event(self, coro, event_name, *args, **kwargs):
+        task = super()._schedule_event(coro, event_name, *args, **kwargs)
+        if self._collected is not None:
+            self._collected.append(task)
+        return task
+
+    def feed(self, event: str, data: dict) -> asyncio.Future:
+        """
+        Parse a gateway event the way the websocket would, e.g. feed("message_create", data).
+        Returns a future that is done when all handlers of the event have finished.
+        """
+        self._collected = []
+        try:
+            getattr(self._connection, f"parse_{event}")(data)
+            tasks = self._collected
+        finally:
+            self._collected = None
+        return asyncio.gather(*tasks)
+
+    async def on_error(self, event_method, *args, **kwargs):
+        self.errors[event_method] += 1
+        if self.errors[event_method] == 1:
+            traceback.print_exc()
+
+    async def on_command_error(self, context, exception):
+        self.errors[f"command {context.command}"] += 1
+        if self.errors[f"command {context.command}"] == 1:
+            traceback.print_exception(
+                type(exception), exception, exception.__traceback__
+            )
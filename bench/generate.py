@@ -0,0 +1,294 @@
+"""
+Generate plopkoek transfers and quotes at scale.
+
+e.g. `python -m bench.generate --db bench.db --transfers 2000000 --quotes 50000`
+
+User activity follows a power law, transfers are spread over the days with a seasonal
+and weekly pattern and no user donates more than DAILY_DONATIONS plopkoeks a day.
+The same seed and options always produce the same data. The transfers end the day before
+--end, which defaults to today: pass the same --end to compare data generated on different days.
+User ids match the users of the benchmark world (bench.fake.World) of the same size.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import accumulate, islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from .fake import BOT_ID, FIRST_CHANNEL_ID, FIRST_MESSAGE_ID
+from .workspace import setup_workspace
+
+# Same as cogs.plopkoek.db.DAILY_DONATIONS, which can only be imported once the workspace is set up.
+DAILY_DONATIONS = 5
+# Exponent of the power law of user activity, the n-th most active user is n^-a as active as the first.
+ACTIVITY_EXPONENT = 1.1
+# Relative activity per weekday, Monday first.
+WEEKDAY_ACTIVITY = (1.0, 1.0, 1.0, 1.05, 1.2, 0.7, 0.6)
+# Relative activity per hour of the day.
+HOUR_ACTIVITY = (
+    (0.3,) * 7
+    + (0.6, 0.9, 1.0, 1.0, 1.1, 1.3, 1.1, 1.0, 1.0, 1.1)
+    + (1.2, 1.3, 1.5, 1.6, 1.5, 1.0, 0.6)
+)
+CHANNELS = 5
+INSERT_BATCH = 100000
+QUOTES_START = datetime(2017, 1, 1)
+SYLLABLES = ("plop", "koek", "ne", "ge", "zot", "ba", "ri", "kul", "do", "mo", "se")
+
+
+def user_ids(users: int) -> List[str]:
+    return [str(BOT_ID + 1 + i) for i in range(users)]
+
+
+def activity_weights(rng: random.Random, users: int) -> List[float]:
+    """
+    Power law weights in a random user order.
+    """
+    weights = [(rank + 1) ** -ACTIVITY_EXPONENT for rank in range(users)]
+    rng.shuffle(weights)
+    return weights
+
+
+def day_weight(day: date, first: date) -> float:
+    """
+    Relative activity on a day: busier in winter, quieter in the weekend
+    and slowly growing since the first day.
+    """
+    season = 1 + 0.35 * math.cos(2 * math.pi * (day.timetuple().tm_yday - 15) / 365.25)
+    growth = 1 + 0.3 * (day - first).days / 365.25
+    return season * growth * WEEKDAY_ACTIVITY[day.weekday()]
+
+
+def generate_transfers(
+    rng: random.Random, users: int, count: int, days: int, end: date
+) -> Iterator[Tuple[str, str, str, str, datetime]]:
+    """
+    Yield `count` (user_from_id, user_to_id, channel_id, message_id, dt) transfers
+    on the `days` days before `end`, in chronological order.
+    A day never holds more transfers than its donators are allowed to make,
+    so fewer transfers are generated if `count` doesn't fit.
+    """
+    ids = user_ids(users)
+    donating = list(accumulate(activity_weights(rng, users)))
+    # Users that donate a lot don't necessarily receive a lot.
+    receiving = list(accumulate(activity_weights(rng, users)))
+    hours = list(accumulate(HOUR_ACTIVITY))
+    first = end - timedelta(days=days)
+    day_list = [first + timedelta(days=i) for i in range(days)]
+    per_day = Counter(
+        rng.choices(
+            range(days),
+            cum_weights=list(accumulate(day_weight(d, first) for d in day_list)),
+            k=count,
+        )
+    )
+    message_id = FIRST_MESSAGE_ID
+    for index, day in enumerate(day_list):
+        donated: Counter = Counter()
+        # Stop drawing once most of the donators are out of plopkoeks for the day.
+        wanted = min(per_day[index], DAILY_DONATIONS * users // 2)
+        moments = sorted(
+            (rng.choices(range(24), cum_weights=hours)[0], rng.randrange(3600))
+            for _ in range(wanted)
+        )
+        start = datetime(day.year, day.month, day.day)
+        for hour, second in moments:
+            donator = rng.choices(ids, cum_weights=donating)[0]
+            while donated[donator] >= DAILY_DONATIONS:
+                donator = rng.choices(ids, cum_weights=donating)[0]
+            donated[donator] += 1
+            receiver = rng.choices(ids, cum_weights=receiving)[0]
+            while receiver == donator:
+                receiver = rng.choices(ids, cum_weights=receiving)[0]
+            # Popular messages get plopkoeks from several users.
+            if rng.random() > 0.3:
+                message_id += 1
+            yield (
+                donator,
+                receiver,
+                str(FIRST_CHANNEL_ID + rng.randrange(CHANNELS)),
+                str(message_id),
+                start + timedelta(hours=hour, seconds=second),
+            )
+
+
+def make_words(rng: random.Random, count: int) -> List[str]:
+    """
+    A vocabulary of `count` made up words, ordered from most to least frequent.
+    """
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(1, 4))))
+    ordered = sorted(words)
+    rng.shuffle(ordered)
+    return ordered
+
+
+def generate_quotes(
+    rng: random.Random, users: int, count: int, quotees: int, vocabulary: int
+) -> Iterator[Tuple[str, str, str, str]]:
+    """
+    Yield `count` (quotee, quote, added_by, added_on) quotes of the first `quotees` users.
+    Quotees are picked by a power law, words by Zipf's law.
+    """
+    ids = user_ids(users)
+    quoted = list(accumulate(activity_weights(rng, quotees)))
+    words = make_words(rng, vocabulary)
+    frequencies = list(accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    added_on = QUOTES_START
+    for _ in range(count):
+        length = max(1, int(rng.lognormvariate(2, 0.6)))
+        quote = " ".join(rng.choices(words, cum_weights=frequencies, k=length))
+        if rng.random() < 0.01:
+            quote = f"/tts {quote}"
+        added_on += timedelta(seconds=rng.randrange(2 * 5 * 365 * 86400 // count + 1))
+        yield (
+            rng.choices(ids[:quotees], cum_weights=quoted)[0],
+            quote,
+            rng.choice(ids),
+            str(added_on),
+        )
+
+
+def insert_transfers(transfers: Iterable[tuple]) -> int:
+    """
+    Insert the transfers in a single transaction and return how many were inserted.
+    The counter trigger is dropped during the insert and the counters are rebuilt afterwards,
+    which is a lot faster than updating them for every row.
+    """
+    from api import db
+    from cogs.plopkoek.db import _init_db, _rebuild_counters
+
+    inserted = 0
+    transfers = iter(transfers)
+    with db.transaction(immediate=True) as conn:
+        _init_db(conn)
+        conn.execute("DROP TRIGGER transfer_counters_insert;")
+        while True:
+            batch = list(islice(transfers, INSERT_BATCH))
+            if not batch:
+                break
+            conn.executemany(
+                "INSERT INTO PlopkoekTransfer"
+                "(user_from_id, user_to_id, channel_id, message_id, dt) "
+                "VALUES (?, ?, ?, ?, ?)",
+                batch,
+            )
+            inserted += len(batch)
+        _init_db(conn)
+        _rebuild_counters(conn)
+    return inserted
+
+
+def insert_quotes(quotes: Iterable[tuple]) -> int:
+    """
+    Insert the quotes into the Quote table and return how many were inserted.
+    """
+    from api import db
+    from cogs.quote.db import init_db
+
+    init_db()
+    rows = list(quotes)
+    with db.transaction(immediate=True) as conn:
+        conn.executemany(
+            "INSERT INTO Quote(quotee, quote, added_by, added_on) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+    return len(rows)
+
+
+def write_quotes_config(path: str, quotes: Iterable[tuple]) -> int:
+    """
+    Write the quotes in the format of config/quotebot and return how many were written.
+    """
+    data: Dict[str, List[dict]] = {}
+    for quotee, quote, added_by, added_on in quotes:
+        data.setdefault(quotee, []).append(
+            {"quote": quote, "added_by": int(added_by), "added_on": added_on}
+        )
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "quotes": data,
+                "random_mode": "uniform",
+                "webhook_id": 0,
+                "webhook_token": "",
+            },
+            f,
+            indent=4,
+        )
+    return sum(map(len, data.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.generate", description=__doc__
+    )
+    parser.add_argument("--db", help="new database to fill with transfers and quotes")
+    parser.add_argument(
+        "--quotes-config", help="also write the quotes as a config/quotebot file here"
+    )
+    parser.add_argument("--transfers", type=int, default=1000000)
+    parser.add_argument("--quotes", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--quotees", type=int, default=300)
+    parser.add_argument("--vocabulary", type=int, default=2000)
+    parser.add_argument(
+        "--days", type=int, default=3 * 365, help="days of history up to --end"
+    )
+    parser.add_argument(
+        "--end",
+        type=date.fromisoformat,
+        default=date.today(),
+        help="day after the last transfer, as YYYY-MM-DD (default: today)",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    if not args.db and not args.quotes_config:
+        parser.error("nothing to do, pass --db and/or --quotes-config")
+    if args.db and os.path.exists(args.db):
+        parser.error(f"{args.db} already exists")
+    if args.users < 2:
+        parser.error("--users must be at least 2, plopkoeks can't be given to yourself")
+    if args.quotees > args.users:
+        parser.error("there can't be more quotees than users")
+
+    def quotes():
+        return generate_quotes(
+            random.Random(args.seed),
+            args.users,
+            args.quotes,
+            args.quotees,
+            args.vocabulary,
+        )
+
+    if args.quotes_config:
+        count = write_quotes_config(args.quotes_config, quotes())
+        print(f"Wrote {count} quotes to {args.quotes_config}")
+    if args.db:
+        with tempfile.TemporaryDirectory(prefix="plopkoek-generate-") as directory:
+            setup_workspace(directory, args.db)
+            start = time.perf_counter()
+            transfers = generate_transfers(
+                random.Random(args.seed),
+                args.users,
+                args.transfers,
+                args.days,
+                args.end,
+            )
+            count = insert_transfers(transfers)
+            print(f"Inserted {count} transfers in {time.perf_counter() - start:.1f}s")
+            start = time.perf_counter()
+            count = insert_quotes(quotes())
+            print(f"Inserted {count} quotes in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Measurements collected while a scenario runs.
+"""
+
+import math
+import sqlite3
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Sequence
+
+_db_lock = threading.Lock()
+# Seconds spent in sqlite per thread name.
+db_time: Dict[str, float] = defaultdict(float)
+
+
+def _record_db_time(start: float):
+    elapsed = time.perf_counter() - start
+    name = threading.current_thread().name
+    with _db_lock:
+        db_time[name] += elapsed
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _record_db_time(start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _record_db_time(start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_db_time(start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_db_time(start)
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            _record_db_time(start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection that adds the time spent in every statement to `db_time`.
+    """
+
+    def execute(self, *args):
+        return self.cursor(TimedCursor).execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor(TimedCursor).executemany(*args)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of the already sorted values.
+    """
+    if not values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(values)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class Recorder:
+    """
+    Handler latencies and errors of the events of a single scenario.
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        # Filled in when the scenario is done.
+        self.http_calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.drain_seconds = 0.0
+        self.started = time.perf_counter()
+        self.finished = self.started
+        self.db_start = dict(db_time)
+
+    def record(self, kind: str, latency: float):
+        self.latencies[kind].append(latency)
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def db_seconds(self) -> Dict[str, float]:
+        return {
+            name: seconds - self.db_start.get(name, 0.0)
+            for name, seconds in db_time.items()
+            if seconds - self.db_start.get(name, 0.0) > 0
+        }
+
+    def rows(self):
+        """
+        Summary rows: kind, events, events/s, p50 ms, p99 ms, max ms.
+        The last row covers all events together.
+        """
+        duration = max(self.finished - self.started, 1e-9)
+        kinds = sorted(self.latencies)
+        everything = [lat for kind in kinds for lat in self.latencies[kind]]
+        rows = []
+        for kind, values in [(kind, self.latencies[kind]) for kind in kinds] + [
+            ("total", everything)
+        ]:
+            values = sorted(values)
+            rows.append(
+                [
+                    kind,
+                    len(values),
+                    len(values) / duration,
+                    percentile(values, 50) * 1000,
+                    percentile(values, 99) * 1000,
+                    (values[-1] if values else 0.0) * 1000,
+                ]
+            )
+        return rows
@@ -0,0 +1,257 @@
+"""
+Benchmark scenarios.
+
+Every scenario prepares the database and the world, then feeds a stream of events to the bot
+and returns a Recorder with the handler latencies of those events.
+History generated by a scenario ends the day before `end`.
+"""
+
+import asyncio
+import random
+import re
+import time
+from collections import Counter
+from datetime import date, datetime
+from functools import partial
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from api import db
+from api.outbox import outbox
+from api.utils import get_value
+
+from .fake import BenchBot, World
+from .generate import (
+    generate_quotes,
+    generate_transfers,
+    insert_quotes,
+    insert_transfers,
+)
+from .measure import Recorder
+
+# Messages posted before the reactions scenario starts, more than PlopkoekCog caches.
+REACTION_MESSAGES = 3000
+# Transfers in the database before the leaderboard storm starts.
+LEADERBOARD_TRANSFERS = 50000
+# Quotes in the archive of the quotes scenario, by this many quotees or all users of a smaller world.
+QUOTE_ARCHIVE = 20000
+QUOTEES = 300
+VOCABULARY = 2000
+
+Event = Tuple[str, str, dict]
+
+
+def _done(recorder: Recorder, kind: str, start: float, future: asyncio.Future):
+    recorder.record(kind, time.perf_counter() - start)
+
+
+async def drive(bot: BenchBot, events: Iterable[Event], rate: float) -> Recorder:
+    """
+    Feed the (kind, gateway event, payload) events to the bot at `rate` events per second,
+    or as fast as possible if rate is 0, and wait until all handlers and queued messages are done.
+    """
+    calls = Counter(bot.http.calls)
+    errors = Counter(bot.errors)
+    recorder = Recorder()
+    pending = []
+    for i, (kind, event, data) in enumerate(events):
+        delay = recorder.started + i / rate - time.perf_counter() if rate else 0
+        await asyncio.sleep(max(delay, 0))
+        future = bot.feed(event, data)
+        future.add_done_callback(partial(_done, recorder, kind, time.perf_counter()))
+        pending.append(future)
+    await asyncio.gather(*pending)
+    recorder.stop()
+    await outbox.drain()
+    recorder.drain_seconds = time.perf_counter() - recorder.finished
+    recorder.http_calls = bot.http.calls - calls
+    recorder.errors = bot.errors - errors
+    return recorder
+
+
+def emote_id() -> int:
+    return int(re.search(r"(\d+)>?$", get_value("plopkoek", "emote")).group(1))
+
+
+def message(world: World, rng: random.Random, content: str, kind: str) -> Event:
+    return (
+        kind,
+        "message_create",
+        world.message_payload(
+            rng.choice(world.channel_ids), rng.choice(world.user_ids), content
+        ),
+    )
+
+
+def chat(world: World, rng: random.Random) -> Event:
+    return message(world, rng, f"chat message {rng.randrange(10 ** 6)}", "message")
+
+
+async def post_messages(bot: BenchBot, world: World, rng: random.Random, count: int):
+    """
+    Post `count` chat messages without measuring them and return their ids.
+    """
+    events = [chat(world, rng) for _ in range(count)]
+    await asyncio.gather(*(bot.feed(event, data) for _, event, data in events))
+    return [int(data["id"]) for _, _, data in events]
+
+
+def count_rows(table: str) -> int:
+    return (
+        db.get_conn()
+        .execute(f"SELECT COUNT(*) AS count FROM {table};")
+        .fetchone()["count"]
+    )
+
+
+async def reactions(
+    bot: BenchBot, world: World, rng: random.Random, events: int, rate: float, end: date
+):
+    """
+    Plopkoek reactions being added to and removed from recent messages,
+    mixed with other reactions, chat and plopkoek messages.
+    """
+    posted = await post_messages(bot, world, rng, REACTION_MESSAGES)
+    plopkoek = emote_id()
+    emote = get_value("plopkoek", "emote")
+    given: List[Tuple[int, int]] = []
+
+    def generate() -> Iterator[Event]:
+        for _ in range(events):
+            roll = rng.random()
+            if roll < 0.1:
+                event = chat(world, rng)
+                posted.append(int(event[2]["id"]))
+                yield event
+            elif roll < 0.15:
+                content = f"{emote} <@!{rng.choice(world.user_ids)}>"
+                yield message(world, rng, content, "plopkoek message")
+            elif roll < 0.25 and given:
+                message_id, user_id = given.pop(rng.randrange(len(given)))
+                data = world.reaction_payload(message_id, user_id, plopkoek, add=False)
+                yield "reaction remove", "message_reaction_remove", data
+            else:
+                # Mostly recent messages, now and then one that is no longer cached.
+                age = min(int(rng.expovariate(1 / 300)), len(posted) - 1)
+                message_id = posted[-1 - age]
+                user_id = rng.choice(world.user_ids)
+                if roll < 0.45:
+                    data = world.reaction_payload(message_id, user_id, plopkoek + 1)
+                    yield "other reaction", "message_reaction_add", data
+                else:
+                    given.append((message_id, user_id))
+                    data = world.reaction_payload(message_id, user_id, plopkoek)
+                    yield "reaction add", "message_reaction_add", data
+
+    return await drive(bot, generate(), rate)
+
+
+async def leaderboards(
+    bot: BenchBot, world: World, rng: random.Random, events: int, rate: float, end: date
+):
+    """
+    A storm of leaderboard commands for the current month, past months and all time,
+    while plopkoeks keep being given.
+    """
+    if not count_rows("PlopkoekTransfer"):
+        start = time.perf_counter()
+        count = insert_transfers(
+            generate_transfers(
+                rng, len(world.user_ids), LEADERBOARD_TRANSFERS, 365, end
+            )
+        )
+        print(f"  generated {count} transfers in {time.perf_counter() - start:.2f}s")
+    posted = await post_messages(bot, world, rng, 500)
+    plopkoek = emote_id()
+    now = datetime.now()
+
+    def generate() -> Iterator[Event]:
+        for _ in range(events):
+            roll = rng.random()
+            if roll < 0.35:
+                yield message(world, rng, "!pk leaders", "!pk leaders")
+            elif roll < 0.6:
+                month = now.month - rng.randint(1, 11)
+                year = now.year - (month < 1)
+                content = (
+                    f"!pk leaders {(month - 1) % 12 + 1} {year} {rng.randint(1, 3)}"
+                )
+                yield message(world, rng, content, "!pk leaders <month>")
+            elif roll < 0.85:
+                content = f"!pk grandleaders {rng.randint(1, 3)}"
+                yield message(world, rng, content, "!pk grandleaders")
+            else:
+                data = world.reaction_payload(
+                    rng.choice(posted), rng.choice(world.user_ids), plopkoek
+                )
+                yield "reaction add", "message_reaction_add", data
+
+    return await drive(bot, generate(), rate)
+
+
+async def quotes(
+    bot: BenchBot, world: World, rng: random.Random, events: int, rate: float, end: date
+):
+    """
+    Chat and quote commands against a large quote archive.
+    """
+    from cogs.quote.index import quote_index
+
+    if not count_rows("Quote"):
+        start = time.perf_counter()
+        count = insert_quotes(
+            generate_quotes(
+                rng,
+                len(world.user_ids),
+                QUOTE_ARCHIVE,
+                min(QUOTEES, len(world.user_ids)),
+                VOCABULARY,
+            )
+        )
+        print(f"  generated {count} quotes in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    quote_index.load()
+    print(f"  loaded the quote index in {time.perf_counter() - start:.2f}s")
+    quotees = quote_index.quotees
+
+    def word() -> str:
+        """
+        A word from a random quote, so common words are searched for more often.
+        """
+        return rng.choice(rng.choice(quote_index.quotes).quote.split())
+
+    def generate() -> Iterator[Event]:
+        for _ in range(events):
+            roll = rng.random()
+            if roll < 0.7:
+                yield chat(world, rng)
+            elif roll < 0.8:
+                content = f"!qb find * {word()} {word()}"
+                yield message(world, rng, content, "!qb find *")
+            elif roll < 0.85:
+                content = f"!qb find {rng.choice(quotees)} {word()}"
+                yield message(world, rng, content, "!qb find <quotee>")
+            elif roll < 0.93:
+                yield message(world, rng, "!qb random", "!qb random")
+            elif roll < 0.96:
+                content = f"!qb list {rng.choice(quotees)}"
+                yield message(world, rng, content, "!qb list")
+            elif roll < 0.995:
+                yield message(world, rng, "!qb stats", "!qb stats")
+            else:
+                yield message(world, rng, "!qb quotees", "!qb quotees")
+
+    return await drive(bot, generate(), rate)
+
+
+class Scenario(NamedTuple):
+    run: Callable
+    events: int
+    # Events per second, 0 feeds them as fast as possible.
+    rate: float
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    "reactions": Scenario(reactions, 10000, 10000 / 60),
+    "leaderboards": Scenario(leaderboards, 2000, 0),
+    "quotes": Scenario(quotes, 2000, 0),
+}
@@ -0,0 +1,43 @@
+"""
+A throwaway config directory, so the cogs can be imported without the real config files.
+"""
+
+import json
+import os
+from typing import Optional
+
+from api import db, utils
+
+from .fake import BOT_ID
+
+CONFIGS = {
+    "main": {
+        "test_env": False,
+        "bot_id": BOT_ID,
+        "discord_token": "",
+        "general_channel_id": 0,
+    },
+    "plopkoek": {
+        "emote": "<:lock:259731815651082251>",
+        "display_name": "plopkoek-bench",
+    },
+    "quotebot": {
+        "quotes": {},
+        "random_mode": "uniform",
+        "webhook_id": 0,
+        "webhook_token": "",
+    },
+}
+
+
+def setup_workspace(directory: str, db_path: Optional[str] = None):
+    """
+    Write the bench configs to the given directory and point the config files to it,
+    this has to happen before any cog is imported.
+    The database is `db_path`, or plopkoek.db inside the directory if no path is given.
+    """
+    for name, data in CONFIGS.items():
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump(data, f)
+    utils.CONFIG_DIR = directory
+    db.DB_PATH = db_path or os.path.join(directory, "plopkoek.db")
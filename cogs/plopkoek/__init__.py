@@ -2,46 +2,106 @@
 Provides a quotebot allowing users to add and traverse quotes.
 """
 
+import asyncio
+import io
+import logging
+import multiprocessing
 import string
-from operator import itemgetter
-from typing import Optional, Union
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Awaitable, Callable, Dict, NamedTuple, Optional, Tuple, Union
 from discord.embeds import Embed
+from discord.file import File
 
+from discord.ext import commands
 from discord.ext.commands.bot import Bot
 from discord.ext.commands.cog import Cog
 from discord.ext.commands.context import Context
 from discord.member import Member
 from discord.message import Message
-from discord.raw_models import RawReactionActionEvent
+from discord.raw_models import (
+    RawMessageDeleteEvent,
+    RawMessageUpdateEvent,
+    RawReactionActionEvent,
+)
 from discord.user import User
 from tabulate import tabulate
 
+from api import metrics
+from api.cache import LRUCache
 from api.cog import PlopCog
 from api.decorators import command
+from api.outbox import MAX_MESSAGE_LENGTH, outbox
 from api.utils import get_value
+from cogs.quote.db import init_db as init_quote_db
+from cogs.quote.index import quote_index
+from plots import render_chord_diagram
 
 from .db import (
-    delete_plopkoek,
+    donate_plopkoek,
     get_alltime_ranking,
-    get_donations_left,
+    get_month_key,
     get_month_ranking,
     get_total_income,
-    has_donated_plopkoek,
+    get_transfer_counts,
     init_db,
     get_income,
-    insert_plopkoek,
+    rebuild_counters,
+    undonate_plopkoek,
 )
+from .quota import donation_quota
+
+logger = logging.getLogger(__name__)
 
 general_channel_id = get_value("main", "general_channel_id")
 plopkoek_emote = get_value("plopkoek", "emote")
 bot_display_name = get_value("plopkoek", "display_name")
 
+NO_DATA_MESSAGE = "No data for the given period :("
+GRAPH_ERROR_MESSAGE = "Could not draw the graph for the given period :("
+# Period of the all-time leaderboard in PlopkoekCog.leaderboards and PlopkoekCog.graphs.
+ALLTIME = "alltime"
+LEADERBOARD_PAGE_SIZE = 10
+# Number of rendered leaderboard pages that are kept.
+LEADERBOARD_CACHE_SIZE = 256
+# Pairs of users with fewer plopkoeks between them are left out of the all-time graph.
+ALLTIME_GRAPH_MIN_TRANSFERS = 3
+
+# Rows shown by !pk stats-internal, the ones with the most total time.
+INTERNAL_STATS_ROWS = 15
+
+# Number of recent messages of which the metadata is kept to handle reactions.
+MESSAGE_CACHE_SIZE = 2000
+
+
+class MessageInfo(NamedTuple):
+    """
+    The parts of a message needed to hand out plopkoeks for it.
+    """
+
+    id: int
+    channel_id: int
+    author: Union[Member, User]
+    webhook_id: Optional[int]
+    content: str
+
+    @classmethod
+    def from_message(cls, message: Message) -> "MessageInfo":
+        return cls(
+            message.id,
+            message.channel.id,
+            message.author,
+            message.webhook_id,
+            message.content,
+        )
+
 
 def can_donate(donator, receiver):
     if donator == receiver:
         return False
 
-    return get_donations_left(donator) > 0
+    return donation_quota.get_donations_left(donator) > 0
 
 
 def filter_ascii_only(data):
@@ -50,13 +110,59 @@ def filter_ascii_only(data):
     ]
 
 
+def render_leaderboard(data, page: int, page_count: int) -> str:
+    """
+    Render one page of ranking data as a table message.
+    """
+    if not data:
+        return NO_DATA_MESSAGE
+    message = tabulate(
+        filter_ascii_only(data),
+        headers=["received", "donated", "user"],
+        tablefmt="fancy_grid",
+    )
+    return f"```{message}```Page {page}/{page_count}"
+
+
 class PlopkoekCog(PlopCog):
     def __init__(self, bot: Bot):
         super().__init__(bot, ("pk", "plopkoek"))
         init_db()
+        init_quote_db()
+        # Loaded now, resolving the receiver of a reaction shouldn't scan the Quote table.
+        quote_index.ensure_loaded()
+        donation_quota.load()
+        self.messages = LRUCache(MESSAGE_CACHE_SIZE)
+        # Rendered leaderboard pages per (month key or ALLTIME, page number).
+        # Entries are dropped when a plopkoek of their period is given or taken back.
+        self.leaderboards = LRUCache(LEADERBOARD_CACHE_SIZE)
+        # Rendered chord diagrams (file content and extension) per month key or ALLTIME.
+        self.graphs: Dict[str, Tuple[bytes, str]] = {}
+        self.periods_version = 0
+        # Graphs are rendered in a separate process, which is only started when needed.
+        self.graph_executor: Optional[ProcessPoolExecutor] = None
+
+    def cog_unload(self):
+        if self.graph_executor is not None:
+            self.graph_executor.shutdown(wait=False)
+
+    async def get_message(self, channel_id: int, message_id: int) -> MessageInfo:
+        """
+        Return the info of the given message, only calling the API if it is not cached.
+        """
+        info = self.messages.get(message_id)
+        if info is None:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                channel = await self.bot.fetch_channel(channel_id)
+            info = MessageInfo.from_message(await channel.fetch_message(message_id))
+            self.messages.put(message_id, info)
+        return info
 
     @Cog.listener()
     async def on_message(self, message: Message):
+        self.messages.put(message.id, MessageInfo.from_message(message))
+
         if message.author.id == self.bot.user.id:
             return
 
@@ -69,64 +175,39 @@ class PlopkoekCog(PlopCog):
                 donator = message.author
                 receiver = await self.get_user(user.strip("<@!>"))
                 if receiver is None:
-                    await donator.send(
-                        "Kon geen plopkoek geven aan onbekende gebruiker. Geen zorgen de plopkoek is veilig terug in je kluis gestoken."
+                    outbox.send(
+                        donator,
+                        "Kon geen plopkoek geven aan onbekende gebruiker. Geen zorgen de plopkoek is veilig terug in je kluis gestoken.",
                     )
                 else:
-                    await self.add_plopkoek(receiver, donator, message)
+                    await self.add_plopkoek(
+                        receiver, donator, MessageInfo.from_message(message)
+                    )
+
+    @Cog.listener()
+    async def on_raw_message_edit(self, payload: RawMessageUpdateEvent):
+        self.messages.pop(payload.message_id)
+
+    @Cog.listener()
+    async def on_raw_message_delete(self, payload: RawMessageDeleteEvent):
+        self.messages.pop(payload.message_id)
 
     @Cog.listener()
     async def on_raw_reaction_add(self, reaction: RawReactionActionEvent):
         if str(reaction.emoji.id) in plopkoek_emote:
-            channel = await self.bot.fetch_channel(reaction.channel_id)
-            message: Message = await channel.fetch_message(reaction.message_id)
-            receiver = message.author
+            message = await self.get_message(reaction.channel_id, reaction.message_id)
+            receiver = await self.resolve_receiver(message)
             donator = reaction.member
 
-            bot_id = get_value("main", "bot_id")
-
-            if receiver.id == bot_id or message.webhook_id == get_value(
-                "quotebot", "webhook_id"
-            ):
-                quote_content = message.content
-                if receiver.display_name == bot_display_name and " -" in quote_content:
-                    quote_content = "-".join(quote_content.split(" -")[:-1])
-                found = False
-                for quotee, quotes in get_value("quotebot", "quotes").items():
-                    for quote in quotes:
-                        if quote["quote"] == quote_content:
-                            receiver = await self.get_user(quotee) or receiver
-                            found = True
-                if not found:
-                    receiver = await self.get_user(str(bot_id))
-
             await self.add_plopkoek(receiver, donator, message)
 
     @Cog.listener()
     async def on_raw_reaction_remove(self, reaction: RawReactionActionEvent):
         if str(reaction.emoji.id) in plopkoek_emote:
-            channel = await self.bot.fetch_channel(reaction.channel_id)
-            message: Message = await channel.fetch_message(reaction.message_id)
-            receiver = message.author
+            message = await self.get_message(reaction.channel_id, reaction.message_id)
+            receiver = await self.resolve_receiver(message)
             donator = await self.get_user(str(reaction.user_id))
 
-            bot_id = get_value("main", "bot_id")
-
-            if receiver.id == bot_id or message.webhook_id == get_value(
-                "quotebot", "webhook_id"
-            ):
-                quote_content = message.content
-                if receiver.display_name == bot_display_name and " -" in quote_content:
-                    quote_content = "-".join(quote_content.split(" -")[:-1])
-                found = False
-                for quotee, quotes in get_value("quotebot", "quotes").items():
-                    for quote in quotes:
-                        if quote["quote"] == quote_content:
-                            receiver = await self.get_user(quotee) or receiver
-                            found = True
-                if not found:
-                    receiver = await self.get_user(str(bot_id))
-
             await self.remove_plopkoek(receiver, donator, message)
 
     @command("total")
@@ -143,8 +224,8 @@ class PlopkoekCog(PlopCog):
             user_id = str(user.id)
             user_name = user.display_name
 
-        message = f"{user_name} has so far earned {get_income(user_id, '%Y-%m')} plopkoeks this month."
-        await ctx.channel.send(message)
+        message = f"{user_name} has so far earned {await get_income(user_id)} plopkoeks this month."
+        outbox.send(ctx.channel, message)
 
     @command("grandtotal")
     async def show_grandtotal(self, ctx: Context, user: Optional[Union[Member, User]]):
@@ -160,119 +241,266 @@ class PlopkoekCog(PlopCog):
             user_id = str(user.id)
             user_name = user.display_name
 
-        message = f"{user_name} has so far earned {get_total_income(user_id)} plopkoeks in total!."
-        await ctx.channel.send(message)
+        message = f"{user_name} has so far earned {await get_total_income(user_id)} plopkoeks in total!."
+        outbox.send(ctx.channel, message)
 
     @command("leaders")
     async def show_leaders(
-        self, ctx: Context, month: Optional[str], year: Optional[str]
+        self,
+        ctx: Context,
+        month: Optional[str],
+        year: Optional[str],
+        page: Optional[int],
     ):
         """
         Get the leaderboard for the current or chosen month.
+        Shows 10 users per page, starting with the first page.
+        A page can only be chosen together with the month and year, e.g. `leaders 3 2021 2`.
         """
-        data = await self.process_ranking_data(*get_month_ranking(month, year))
-        if not data:
-            await ctx.channel.send("No data for the given period :(")
-        while data:
-            table_data = filter_ascii_only(data[:10])
-            message = tabulate(
-                table_data,
-                headers=["received", "donated", "user"],
-                tablefmt="fancy_grid",
-            )
-            await ctx.channel.send(f"```{message}```")
-            data = data[10:]
+        key = get_month_key(month, year)
+        if key is None:
+            outbox.send(ctx.channel, NO_DATA_MESSAGE)
+            return
+        outbox.send(
+            ctx.channel,
+            await self.get_leaderboard(key, page or 1, partial(get_month_ranking, key)),
+        )
 
     @command("grandleaders")
-    async def show_grandleaders(self, ctx: Context):
+    async def show_grandleaders(self, ctx: Context, page: Optional[int]):
         """
         Get the all-time leaderboard.
+        Shows 10 users per page, starting with the first page.
+        """
+        outbox.send(
+            ctx.channel,
+            await self.get_leaderboard(ALLTIME, page or 1, get_alltime_ranking),
+        )
+
+    @command("graph")
+    async def show_graph(self, ctx: Context, month: Optional[str], year: Optional[str]):
+        """
+        Show who gave plopkoeks to whom in the current or chosen month.
+        Use "alltime" as month to show all plopkoeks ever given.
+        """
+        period = ALLTIME if month == ALLTIME else get_month_key(month, year)
+        graph = await self.get_graph(period) if period is not None else NO_DATA_MESSAGE
+        if isinstance(graph, str):
+            outbox.send(ctx.channel, graph)
+            return
+        content, extension = graph
+        await ctx.channel.send(
+            file=File(io.BytesIO(content), filename=f"plopkoek-{period}.{extension}")
+        )
+
+    @commands.is_owner()
+    @command("rebuild")
+    async def rebuild(self, ctx: Context):
+        """
+        Regenerate the monthly and all-time counters from the transfer history.
+        Only the bot owner can do this, it blocks all plopkoek writes until it is done.
+        """
+        await rebuild_counters()
+        self.invalidate_periods()
+        outbox.send(ctx.channel, "Plopkoek counters have been rebuilt.")
+
+    @command("stats-internal")
+    async def show_internal_stats(self, ctx: Context):
+        """
+        Show where the bot spends its time, if metrics are enabled in the main config.
         """
-        data = await self.process_ranking_data(*get_alltime_ranking())
-        if not data:
-            await ctx.channel.send("No data for the given period :(")
-        while data:
-            table_data = filter_ascii_only(data[:10])
+        if not metrics.enabled:
+            outbox.send(ctx.channel, "Metrics are disabled.")
+            return
+        rows = [
+            [metric, name, count, total, p50 * 1000, p99 * 1000]
+            for metric, name, count, total, p50, p99 in metrics.summary()
+        ][:INTERNAL_STATS_ROWS]
+        while True:
             message = tabulate(
-                table_data,
-                headers=["received", "donated", "user"],
-                tablefmt="fancy_grid",
+                rows,
+                headers=["metric", "name", "calls", "total s", "p50 ms", "p99 ms"],
+                floatfmt=".3f",
+            )
+            if len(message) + 6 <= MAX_MESSAGE_LENGTH or not rows:
+                break
+            rows.pop()
+        outbox.send(ctx.channel, f"```{message}```")
+
+    async def get_leaderboard(
+        self, period: str, page: int, get_ranking: Callable[..., Awaitable]
+    ) -> str:
+        """
+        Return the rendered leaderboard page for the given period.
+        If it is not cached, it is rendered from the data returned by
+        `get_ranking(limit, offset)`, which returns the last page for offsets past the end.
+        Pages past the end are rendered and cached as the last page.
+        """
+        page = max(page, 1)
+        message = self.leaderboards.get((period, page))
+        if message is None:
+            version = self.periods_version
+            data, count = await get_ranking(
+                LEADERBOARD_PAGE_SIZE, (page - 1) * LEADERBOARD_PAGE_SIZE
+            )
+            page_count = max(-(-count // LEADERBOARD_PAGE_SIZE), 1)
+            page = min(page, page_count)
+            message = render_leaderboard(
+                await self.process_ranking_data(data), page, page_count
             )
-            await ctx.channel.send(f"```{message}```")
-            data = data[10:]
+            # Don't cache pages that were already outdated while they were rendered.
+            if version == self.periods_version:
+                self.leaderboards.put((period, page), message)
+        return message
+
+    async def get_graph(self, period: str) -> Union[Tuple[bytes, str], str]:
+        """
+        Return the rendered chord diagram of the given period and its file extension,
+        or the message to show instead if no plopkoeks were given in that period
+        or the diagram could not be rendered.
+        """
+        graph = self.graphs.get(period)
+        if graph is None:
+            version = self.periods_version
+            if period == ALLTIME:
+                rows = await get_transfer_counts(None, ALLTIME_GRAPH_MIN_TRANSFERS)
+            else:
+                rows = await get_transfer_counts(period)
+            if not rows:
+                return NO_DATA_MESSAGE
+            rows = [
+                (row["user_from_id"], row["user_to_id"], row["count"]) for row in rows
+            ]
+            user_ids = list({user_id for row in rows for user_id in row[:2]})
+            names = dict(zip(user_ids, await self.get_user_names(user_ids)))
+
+            if self.graph_executor is None:
+                # Spawn instead of fork, the bot process runs several threads.
+                self.graph_executor = ProcessPoolExecutor(
+                    max_workers=1, mp_context=multiprocessing.get_context("spawn")
+                )
+            try:
+                graph = await asyncio.get_running_loop().run_in_executor(
+                    self.graph_executor,
+                    render_chord_diagram,
+                    rows,
+                    names,
+                    f"Plopkoeken {period}",
+                )
+            except Exception as e:
+                logger.exception(f"Could not render the plopkoek graph of {period}")
+                if isinstance(e, BrokenProcessPool):
+                    # Start a new process for the next graph.
+                    self.graph_executor = None
+                return GRAPH_ERROR_MESSAGE
+            # Don't cache graphs that were already outdated while they were rendered.
+            if version == self.periods_version:
+                self.graphs[period] = graph
+        return graph
+
+    def invalidate_periods(self, *periods: str):
+        """
+        Drop the cached leaderboards and graphs for the given periods,
+        or all of them if no periods are given.
+        """
+        self.periods_version += 1
+        if not periods:
+            self.leaderboards.clear()
+            self.graphs.clear()
+        for key in [key for key in self.leaderboards.data if key[0] in periods]:
+            self.leaderboards.pop(key)
+        for period in periods:
+            self.graphs.pop(period, None)
 
     async def add_plopkoek(
         self,
         receiver: User,
         donator: User,
-        message: Message,
+        message: MessageInfo,
     ):
         if not can_donate(donator.id, receiver.id):
             return
 
-        insert_plopkoek(donator.id, receiver.id, message.channel.id, message.id)
+        result = await donate_plopkoek(
+            donator.id, receiver.id, message.channel_id, message.id
+        )
+        if result is None:
+            donation_quota.set_donations_left(donator.id, 0)
+            return
+        income, donations_left = result
+        donation_quota.set_donations_left(donator.id, donations_left)
+        self.invalidate_periods(get_month_key(), ALLTIME)
 
         embed = Embed(description=message.content)
         embed.set_author(name=receiver.display_name, icon_url=receiver.avatar_url)
 
         try:
-            content = f"Je hebt een plopkoek van {donator.display_name} gekregen!  Je hebt er nu {get_income(receiver.id, '%Y-%m')} deze maand verzameld. Goe bezig!"
-            await receiver.send(content, embed=embed)
+            content = f"Je hebt een plopkoek van {donator.display_name} gekregen!  Je hebt er nu {income} deze maand verzameld. Goe bezig!"
+            outbox.send(receiver, content, embed=embed)
         except AttributeError:
             pass
 
-        donations_left = get_donations_left(donator.id)
         if donations_left == 0:
             content = f"Je hebt een plopkoek aan {receiver.display_name} gegeven.  Da was uwe laatste plopkoek van vandaag, geefde gij ook zo gemakkelijk geld uit?"
         else:
             content = f"Je hebt een plopkoek aan {receiver.display_name} gegeven.  Je kan er vandaag nog {donations_left} uitgeven. Spenden die handel!"
-        await donator.send(content, embed=embed)
+        outbox.send(donator, content, embed=embed)
 
     async def remove_plopkoek(
         self,
         receiver: User,
         donator: User,
-        message: Message,
+        message: MessageInfo,
     ):
-        if has_donated_plopkoek(
-            donator.id, receiver.id, message.channel.id, message.id
-        ):
-            delete_plopkoek(donator.id, receiver.id, message.channel.id, message.id)
+        result = await undonate_plopkoek(
+            donator.id, receiver.id, message.channel_id, message.id
+        )
+        if result is None:
+            return
+        income, donations_left, months = result
+        donation_quota.set_donations_left(donator.id, donations_left)
+        # The plopkoek may have been given in an earlier month.
+        self.invalidate_periods(*months, ALLTIME)
 
-            try:
-                content = f"{donator.display_name} heeft een plopkoek afgepakt :O  Je hebt er nu nog {get_income(receiver.id, '%Y-%m')} deze maand over."
-                await receiver.send(content=content)
-            except AttributeError:
-                pass
-
-            content = (
-                f"Je hebt een plopkoek die je aan {receiver.display_name} hebt gegeven teruggenomen. (Gij se evil bastard!) "
-                f"Je kan er vandaag nog {get_donations_left(donator.id)} uitgeven."
-            )
-            await donator.send(content=content)
-
-    async def process_ranking_data(self, received_data, donated_data):
-        dict_data = {}
-        for row in received_data:
-            uid = row["user_to_id"]
-            username = await self.get_user_name(uid)
-            dict_data[uid] = {
-                "received": row["received"],
-                "user": username,
-                "donated": 0,
-            }
-        for row in donated_data:
-            uid = row["user_from_id"]
-            if uid not in dict_data:
-                username = await self.get_user_name(uid)
-                dict_data[uid] = {"user": username, "received": 0}
-            dict_data[uid]["donated"] = row["donated"]
-        list_data = []
-        for dd in sorted(
-            list(dict_data.values()), key=itemgetter("received"), reverse=True
+        try:
+            content = f"{donator.display_name} heeft een plopkoek afgepakt :O  Je hebt er nu nog {income} deze maand over."
+            outbox.send(receiver, content=content)
+        except AttributeError:
+            pass
+
+        content = (
+            f"Je hebt een plopkoek die je aan {receiver.display_name} hebt gegeven teruggenomen. (Gij se evil bastard!) "
+            f"Je kan er vandaag nog {donations_left} uitgeven."
+        )
+        outbox.send(donator, content=content)
+
+    async def resolve_receiver(self, message: MessageInfo) -> User:
+        """
+        Return the user that should receive the plopkoeks for a message.
+        Quotes posted by the bot or the quotebot webhook belong to the quotee,
+        unknown quotes belong to the bot itself.
+        """
+        receiver = message.author
+        bot_id = get_value("main", "bot_id")
+
+        if receiver.id == bot_id or message.webhook_id == get_value(
+            "quotebot", "webhook_id"
         ):
-            list_data.append([dd["received"], dd["donated"], dd["user"]])
-        return list_data
+            quote_content = message.content
+            if receiver.display_name == bot_display_name and " -" in quote_content:
+                quote_content = quote_content.rsplit(" -", 1)[0]
+            quotee = quote_index.find_quotee(quote_content)
+            if quotee is None:
+                return await self.get_user(str(bot_id))
+            return await self.get_user(quotee) or receiver
+        return receiver
+
+    async def process_ranking_data(self, data):
+        usernames = await self.get_user_names(row["user_id"] for row in data)
+        return [
+            [row["received"], row["donated"], username]
+            for row, username in zip(data, usernames)
+        ]
 
 
 def setup(bot: Bot):
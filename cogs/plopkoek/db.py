@@ -1,12 +1,69 @@
-from datetime import datetime
+from datetime import MAXYEAR, MINYEAR, date, datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
 from api import db
 
+DAILY_DONATIONS = 5
+
+
+def month_key(year: int, month: int) -> str:
+    """
+    Return the key of the given month as used by PlopkoekMonthly, e.g. "2021-03".
+    """
+    if not 1 <= month <= 12:
+        raise ValueError(f"Invalid month {month}")
+    if not MINYEAR <= year <= MAXYEAR:
+        raise ValueError(f"Invalid year {year}")
+    return f"{year:04d}-{month:02d}"
+
+
+def get_month_key(
+    month: Optional[str] = None, year: Optional[str] = None
+) -> Optional[str]:
+    """
+    Return the month key for the given month and year, defaulting to the current ones.
+    Returns None if they don't form a month of which month_bounds can be computed.
+    """
+    now = datetime.now()
+    try:
+        key = month_key(
+            int(year) if year else now.year, int(month) if month else now.month
+        )
+        month_bounds(key)
+    except ValueError:
+        return None
+    return key
+
+
+def day_bounds(day: date) -> Tuple[datetime, datetime]:
+    """
+    Return the half-open [start, end) timestamp range of the given day.
+    """
+    start = datetime(day.year, day.month, day.day)
+    return start, start + timedelta(days=1)
+
+
+def month_bounds(key: str) -> Tuple[datetime, datetime]:
+    """
+    Return the half-open [start, end) timestamp range of the month with the given key.
+    """
+    year, month = (int(part) for part in key.split("-"))
+    start = datetime(year, month, 1)
+    if month == 12:
+        return start, datetime(year + 1, 1, 1)
+    return start, datetime(year, month + 1, 1)
+
 
 def init_db():
     """
     Initialize the plopkoek database with the PlopkoekTransfer table if no existing table is found.
+    Missing indexes and counter tables are added to existing databases.
     """
-    conn = db.get_conn()
+    with db.transaction(immediate=True) as conn:
+        _init_db(conn)
+
+
+def _init_db(conn):
     # User table
     conn.execute(
         "CREATE TABLE IF NOT EXISTS PlopkoekTransfer("
@@ -18,119 +75,292 @@ def init_db():
         "FOREIGN KEY(user_from_id) REFERENCES User(user_id),"
         "FOREIGN KEY(user_to_id) REFERENCES User(user_id));"
     )
-    conn.close()
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transfer_to_dt "
+        "ON PlopkoekTransfer(user_to_id, dt);"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transfer_from_dt "
+        "ON PlopkoekTransfer(user_from_id, dt);"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_transfer_message_from "
+        "ON PlopkoekTransfer(message_id, user_from_id);"
+    )
 
+    # Received and donated counters per user per month and for all time.
+    # These are kept in sync with PlopkoekTransfer by triggers.
+    exists = conn.execute(
+        "SELECT COUNT(*) AS count FROM sqlite_master "
+        "WHERE type='table' AND name='PlopkoekMonthly';"
+    ).fetchone()["count"]
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS PlopkoekMonthly("
+        "user_id TEXT(64) NOT NULL,"
+        "month TEXT(7) NOT NULL,"
+        "received INTEGER NOT NULL DEFAULT 0,"
+        "donated INTEGER NOT NULL DEFAULT 0,"
+        "PRIMARY KEY(user_id, month));"
+    )
+    conn.execute("DROP INDEX IF EXISTS idx_monthly_month;")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_monthly_ranking "
+        "ON PlopkoekMonthly(month, received DESC, donated DESC, user_id);"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS PlopkoekTotal("
+        "user_id TEXT(64) PRIMARY KEY,"
+        "received INTEGER NOT NULL DEFAULT 0,"
+        "donated INTEGER NOT NULL DEFAULT 0);"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_total_ranking "
+        "ON PlopkoekTotal(received DESC, donated DESC, user_id);"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS transfer_counters_insert "
+        "AFTER INSERT ON PlopkoekTransfer BEGIN "
+        "INSERT INTO PlopkoekMonthly(user_id, month, received) "
+        "VALUES (new.user_to_id, substr(new.dt, 1, 7), 1) "
+        "ON CONFLICT(user_id, month) DO UPDATE SET received = received + 1; "
+        "INSERT INTO PlopkoekMonthly(user_id, month, donated) "
+        "VALUES (new.user_from_id, substr(new.dt, 1, 7), 1) "
+        "ON CONFLICT(user_id, month) DO UPDATE SET donated = donated + 1; "
+        "INSERT INTO PlopkoekTotal(user_id, received) VALUES (new.user_to_id, 1) "
+        "ON CONFLICT(user_id) DO UPDATE SET received = received + 1; "
+        "INSERT INTO PlopkoekTotal(user_id, donated) VALUES (new.user_from_id, 1) "
+        "ON CONFLICT(user_id) DO UPDATE SET donated = donated + 1; "
+        "END;"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS transfer_counters_delete "
+        "AFTER DELETE ON PlopkoekTransfer BEGIN "
+        "UPDATE PlopkoekMonthly SET received = received - 1 "
+        "WHERE user_id = old.user_to_id AND month = substr(old.dt, 1, 7); "
+        "UPDATE PlopkoekMonthly SET donated = donated - 1 "
+        "WHERE user_id = old.user_from_id AND month = substr(old.dt, 1, 7); "
+        "UPDATE PlopkoekTotal SET received = received - 1 "
+        "WHERE user_id = old.user_to_id; "
+        "UPDATE PlopkoekTotal SET donated = donated - 1 "
+        "WHERE user_id = old.user_from_id; "
+        "END;"
+    )
+    if not exists:
+        _rebuild_counters(conn)
 
-def get_income(user_id, fmt):
-    conn = db.get_conn()
-    count = conn.execute(
-        "SELECT COUNT(*) AS count FROM PlopkoekTransfer WHERE "
-        "strftime(?, datetime(dt)) == strftime(?, 'now') AND "
-        "user_to_id == ?;",
-        (
-            fmt,
-            fmt,
-            user_id,
-        ),
-    ).fetchone()
-    conn.close()
-    return count["count"]
 
+def _rebuild_counters(conn):
+    conn.execute("DELETE FROM PlopkoekMonthly;")
+    conn.execute("DELETE FROM PlopkoekTotal;")
+    conn.execute(
+        "INSERT INTO PlopkoekMonthly(user_id, month, received) "
+        "SELECT user_to_id, substr(dt, 1, 7), COUNT(*) FROM PlopkoekTransfer "
+        "GROUP BY user_to_id, substr(dt, 1, 7);"
+    )
+    conn.execute(
+        "INSERT INTO PlopkoekMonthly(user_id, month, donated) "
+        "SELECT user_from_id, substr(dt, 1, 7), COUNT(*) FROM PlopkoekTransfer "
+        "WHERE true GROUP BY user_from_id, substr(dt, 1, 7) "
+        "ON CONFLICT(user_id, month) DO UPDATE SET donated = excluded.donated;"
+    )
+    conn.execute(
+        "INSERT INTO PlopkoekTotal(user_id, received, donated) "
+        "SELECT user_id, SUM(received), SUM(donated) FROM PlopkoekMonthly "
+        "GROUP BY user_id;"
+    )
 
-def get_total_income(user_id):
-    conn = db.get_conn()
-    count = conn.execute(
-        "SELECT COUNT(*) AS count FROM PlopkoekTransfer WHERE user_to_id == ?;",
-        (user_id,),
-    ).fetchone()["count"]
-    conn.close()
-    return count
+
+@db.run_in_db_thread
+def rebuild_counters():
+    """
+    Regenerate the PlopkoekMonthly and PlopkoekTotal counters from PlopkoekTransfer.
+    """
+    with db.transaction(immediate=True) as conn:
+        _rebuild_counters(conn)
+
+
+def _get_income(conn, user_id):
+    now = datetime.now()
+    row = conn.execute(
+        "SELECT received FROM PlopkoekMonthly WHERE user_id == ? AND month == ?;",
+        (user_id, month_key(now.year, now.month)),
+    ).fetchone()
+    return row["received"] if row else 0
 
 
-def get_donations_left(user_id):
-    conn = db.get_conn()
+def _get_donations_left(conn, user_id):
+    start, end = day_bounds(date.today())
     count = conn.execute(
-        "SELECT COUNT(*) As count FROM PlopkoekTransfer WHERE date(dt) == date('now') AND user_from_id==?;",
-        (user_id,),
+        "SELECT COUNT(*) As count FROM PlopkoekTransfer "
+        "WHERE user_from_id == ? AND dt >= ? AND dt < ?;",
+        (user_id, start, end),
     ).fetchone()
-    conn.close()
-    return 5 - count["count"]
+    return DAILY_DONATIONS - count["count"]
 
 
-def insert_plopkoek(donator_id, receiver_id, channel_id, message_id):
-    conn = db.get_conn()
+def _insert_plopkoek(conn, donator_id, receiver_id, channel_id, message_id):
     conn.execute(
         "INSERT INTO PlopkoekTransfer(user_from_id, user_to_id, channel_id, message_id, dt) VALUES (?, ?, ?, ?, ?)",
         (donator_id, receiver_id, channel_id, message_id, datetime.now()),
     )
-    conn.commit()
-    conn.close()
 
 
-def delete_plopkoek(donator_id, receiver_id, channel_id, message_id):
-    conn = db.get_conn()
-    conn.execute(
-        "DELETE FROM PlopkoekTransfer "
-        "WHERE user_to_id==? AND user_from_id==? AND channel_id=? AND message_id=?",
-        (receiver_id, donator_id, channel_id, message_id),
+def _delete_plopkoek(conn, donator_id, receiver_id, channel_id, message_id) -> Set[str]:
+    """
+    Delete the matching transfers and return the month keys of the deleted transfers.
+    """
+    params = (receiver_id, donator_id, channel_id, message_id)
+    where = "WHERE user_to_id==? AND user_from_id==? AND channel_id=? AND message_id=?"
+    months = {
+        row["month"]
+        for row in conn.execute(
+            f"SELECT substr(dt, 1, 7) AS month FROM PlopkoekTransfer {where}", params
+        )
+    }
+    if months:
+        conn.execute(f"DELETE FROM PlopkoekTransfer {where}", params)
+    return months
+
+
+@db.run_in_db_thread
+def get_income(user_id):
+    """
+    Return the number of plopkoeks received this month.
+    """
+    return _get_income(db.get_conn(), user_id)
+
+
+@db.run_in_db_thread
+def get_total_income(user_id):
+    row = (
+        db.get_conn()
+        .execute("SELECT received FROM PlopkoekTotal WHERE user_id == ?;", (user_id,))
+        .fetchone()
     )
-    conn.commit()
-    conn.close()
+    return row["received"] if row else 0
 
 
-def has_donated_plopkoek(donator_id, receiver_id, channel_id, message_id) -> bool:
-    conn = db.get_conn()
-    count = conn.execute(
-        "SELECT COUNT(*) AS count FROM PlopkoekTransfer "
-        "WHERE user_to_id==? AND user_from_id==? AND channel_id=? AND message_id=?",
-        (receiver_id, donator_id, channel_id, message_id),
-    ).fetchone()["count"]
-    conn.close()
-    return count > 0
-
-
-def get_month_ranking(month=None, year=None):
-    if not month:
-        month = str(datetime.utcnow().month)
-    if not year:
-        year = str(datetime.utcnow().year)
-    if len(month) == 1:
-        month = "0" + month
-
-    conn = db.get_conn()
-    received_data = conn.execute(
-        "SELECT user_to_id, COUNT(user_to_id) AS received "
-        "FROM PlopkoekTransfer "
-        "WHERE strftime('%m', datetime(dt)) == ? AND "
-        "strftime('%Y', datetime(dt)) == ? "
-        "GROUP BY user_to_id",
-        (month, year),
-    ).fetchall()
-
-    donated_data = conn.execute(
-        "SELECT user_from_id, COUNT(user_from_id) AS donated "
-        "FROM PlopkoekTransfer "
-        "WHERE strftime('%m', datetime(dt)) == ? AND "
-        "strftime('%Y', datetime(dt)) == ? "
-        "GROUP BY user_from_id",
-        (month, year),
-    ).fetchall()
-    conn.close()
-    return received_data, donated_data
-
-
-def get_alltime_ranking():
-    conn = db.get_conn()
-    received_data = conn.execute(
-        "SELECT user_to_id, COUNT(user_to_id) AS received "
-        "FROM PlopkoekTransfer "
-        "GROUP BY user_to_id"
-    ).fetchall()
-
-    donated_data = conn.execute(
-        "SELECT user_from_id, COUNT(user_from_id) AS donated "
-        "FROM PlopkoekTransfer "
-        "GROUP BY user_from_id"
-    ).fetchall()
-    conn.close()
-    return received_data, donated_data
+def get_donations_today() -> Dict[str, int]:
+    """
+    Return the number of plopkoeks donated today by every user that donated today.
+    """
+    start, end = day_bounds(date.today())
+    return {
+        row["user_from_id"]: row["count"]
+        for row in db.get_conn().execute(
+            "SELECT user_from_id, COUNT(*) AS count FROM PlopkoekTransfer "
+            "WHERE dt >= ? AND dt < ? GROUP BY user_from_id;",
+            (start, end),
+        )
+    }
+
+
+@db.run_in_db_thread
+def donate_plopkoek(
+    donator_id, receiver_id, channel_id, message_id
+) -> Optional[Tuple[int, int]]:
+    """
+    Transfer a plopkoek if the donator has donations left today.
+
+    The quota check, the transfer and the reads of the new totals happen in one transaction.
+    Returns the receiver's income this month and the donator's donations left today,
+    or None if the donator has no donations left.
+    """
+    with db.transaction(immediate=True) as conn:
+        donations_left = _get_donations_left(conn, donator_id)
+        if donations_left <= 0:
+            return None
+        _insert_plopkoek(conn, donator_id, receiver_id, channel_id, message_id)
+        return _get_income(conn, receiver_id), donations_left - 1
+
+
+@db.run_in_db_thread
+def undonate_plopkoek(
+    donator_id, receiver_id, channel_id, message_id
+) -> Optional[Tuple[int, int, Set[str]]]:
+    """
+    Take back a plopkoek given for the given message.
+
+    Returns the receiver's income this month, the donator's donations left today
+    and the keys of the months in which the plopkoek was given,
+    or None if no such plopkoek was given.
+    """
+    with db.transaction(immediate=True) as conn:
+        months = _delete_plopkoek(conn, donator_id, receiver_id, channel_id, message_id)
+        if not months:
+            return None
+        return (
+            _get_income(conn, receiver_id),
+            _get_donations_left(conn, donator_id),
+            months,
+        )
+
+
+def last_page_offset(offset: int, limit: int, count: int) -> int:
+    """
+    Clamp a page offset to the start of the last page of `count` rows.
+    """
+    return max(min(offset, (count - 1) // limit * limit), 0)
+
+
+@db.run_in_db_thread
+def get_month_ranking(key: str, limit: int, offset: int = 0):
+    """
+    Return one page of the ranking of the given month, ordered by plopkoeks received,
+    and the total number of users in the ranking.
+    Every row holds the user_id and the number of plopkoeks received and donated.
+    An offset past the end of the ranking returns its last page.
+    """
+    with db.transaction() as conn:
+        count = conn.execute(
+            "SELECT COUNT(*) AS count FROM PlopkoekMonthly "
+            "WHERE month == ? AND (received > 0 OR donated > 0)",
+            (key,),
+        ).fetchone()["count"]
+        data = conn.execute(
+            "SELECT user_id, received, donated FROM PlopkoekMonthly "
+            "WHERE month == ? AND (received > 0 OR donated > 0) "
+            "ORDER BY received DESC, donated DESC, user_id LIMIT ? OFFSET ?",
+            (key, limit, last_page_offset(offset, limit, count)),
+        ).fetchall()
+    return data, count
+
+
+@db.run_in_db_thread
+def get_alltime_ranking(limit: int, offset: int = 0):
+    """
+    Same as get_month_ranking for all plopkoeks ever given.
+    """
+    with db.transaction() as conn:
+        count = conn.execute(
+            "SELECT COUNT(*) AS count FROM PlopkoekTotal "
+            "WHERE received > 0 OR donated > 0"
+        ).fetchone()["count"]
+        data = conn.execute(
+            "SELECT user_id, received, donated FROM PlopkoekTotal "
+            "WHERE received > 0 OR donated > 0 "
+            "ORDER BY received DESC, donated DESC, user_id LIMIT ? OFFSET ?",
+            (limit, last_page_offset(offset, limit, count)),
+        ).fetchall()
+    return data, count
+
+
+@db.run_in_db_thread
+def get_transfer_counts(key: Optional[str] = None, min_count: int = 1):
+    """
+    Return the number of plopkoeks every user gave to every other user in the month
+    with the given key, or for all time if no key is given.
+    Every row holds the user_from_id, the user_to_id and the count,
+    pairs with less than `min_count` plopkoeks are left out.
+    """
+    query = "SELECT user_from_id, user_to_id, COUNT(*) AS count FROM PlopkoekTransfer "
+    params: List = []
+    if key is not None:
+        query += "WHERE dt >= ? AND dt < ? "
+        params.extend(month_bounds(key))
+    query += (
+        "GROUP BY user_from_id, user_to_id HAVING COUNT(*) >= ? "
+        "ORDER BY user_from_id, user_to_id;"
+    )
+    params.append(min_count)
+    return db.get_conn().execute(query, params).fetchall()
@@ -0,0 +1,38 @@
+"""
+In-memory tracker of the number of plopkoeks every user has donated today.
+
+The database stays the source of truth: the tracker is loaded from it at startup
+and overwritten with the database counts after every donation or removal.
+"""
+
+from datetime import date
+from typing import Dict
+
+from .db import DAILY_DONATIONS, get_donations_today
+
+
+class DonationQuota:
+    def __init__(self) -> None:
+        self.day = date.today()
+        self.donated: Dict[str, int] = {}
+
+    def _check_day(self):
+        today = date.today()
+        if today != self.day:
+            self.day = today
+            self.donated = {}
+
+    def load(self):
+        self.day = date.today()
+        self.donated = get_donations_today()
+
+    def get_donations_left(self, user_id) -> int:
+        self._check_day()
+        return DAILY_DONATIONS - self.donated.get(str(user_id), 0)
+
+    def set_donations_left(self, user_id, donations_left: int):
+        self._check_day()
+        self.donated[str(user_id)] = DAILY_DONATIONS - donations_left
+
+
+donation_quota = DonationQuota()
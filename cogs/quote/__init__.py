@@ -2,12 +2,11 @@
 Provides a quotebot allowing users to add and traverse quotes.
 """
 
-import random
-from collections import Counter, defaultdict
-from datetime import datetime
+from collections import defaultdict
 from typing import Dict, List, Optional, Union
 
-from discord import Webhook, RequestsWebhookAdapter
+import aiohttp
+from discord import AsyncWebhookAdapter, Webhook
 from discord.channel import TextChannel
 from discord.ext.commands.cog import Cog
 from discord.member import Member
@@ -16,34 +15,61 @@ from discord.user import User
 from discord.ext.commands.bot import Bot
 from discord.ext.commands.context import Context
 
+from api import metrics
 from api.cog import PlopCog
 from api.decorators import command
-from api.utils import get_value, set_value
-
+from api.utils import get_data, get_value
+
+from .db import (
+    find_quotes,
+    get_quote_count,
+    get_quotees,
+    get_quotes,
+    get_top_quotees,
+    has_quotee,
+    init_db,
+    insert_quote,
+)
+from .index import SAMPLING_MODES, quote_index
 
 quote_url = "https://cdn1.iconfinder.com/data/icons/anchor/128/quote.png"
 webhook_id = get_value("quotebot", "webhook_id")
 webhook_token = get_value("quotebot", "webhook_token")
 general_channel_id = get_value("main", "general_channel_id")
+# Searches with more results than this only report that there are too many.
+FIND_MAX_QUOTES = 25
+
+_webhook_session: Optional[aiohttp.ClientSession] = None
+_webhook: Optional[Webhook] = None
 
 
-def get_random_quote():
+def get_webhook() -> Webhook:
     """
-    Return a random quote from the quote list.
+    Return the quotebot webhook.
+    All sends share a single aiohttp session, which is created on first use.
+    Rate limits and transient server errors are retried by the AsyncWebhookAdapter.
     """
-    quotelist = []
-    for quotee, quotes in get_value("quotebot", "quotes").items():
-        for quote in quotes:
-            quotelist.append({"quote": quote["quote"], "quotee": quotee})
-    return random.choice(quotelist)
+    global _webhook_session, _webhook
+    if _webhook is None:
+        _webhook_session = aiohttp.ClientSession()
+        adapter = AsyncWebhookAdapter(_webhook_session)
+        if metrics.enabled:
+            metrics.instrument_webhook_adapter(adapter)
+        _webhook = Webhook.partial(webhook_id, webhook_token, adapter=adapter)
+    return _webhook
+
+
+async def close_webhook():
+    global _webhook_session, _webhook
+    if _webhook_session is not None:
+        await _webhook_session.close()
+    _webhook_session = None
+    _webhook = None
 
 
 async def post_message(channel: TextChannel, content: str):
     if channel.id == general_channel_id:
-        webhook = Webhook.partial(
-            webhook_id, webhook_token, adapter=RequestsWebhookAdapter()
-        )
-        webhook.send(content, username="quotebot", avatar_url=quote_url)
+        await get_webhook().send(content, username="quotebot", avatar_url=quote_url)
     else:
         await channel.send(content)
 
@@ -61,10 +87,9 @@ async def post_quote(channel: TextChannel, quote: str, user: Union[Member, User,
         user_name = user.display_name
 
     if channel.id == general_channel_id:
-        webhook = Webhook.partial(
-            webhook_id, webhook_token, adapter=RequestsWebhookAdapter()
+        await get_webhook().send(
+            quote, username=user_name, avatar_url=avatar_url, tts=tts
         )
-        webhook.send(quote, username=user_name, avatar_url=avatar_url, tts=tts)
     else:
         await channel.send(f"{quote} - {user_name}", tts=tts)
 
@@ -79,6 +104,14 @@ class QuoteCog(PlopCog):
     def __init__(self, bot: Bot):
         super().__init__(bot, ("qb", "quotebot"))
         self.message_count: Dict[str, int] = defaultdict(int)
+        init_db()
+        quote_index.ensure_loaded()
+        self.random_mode = get_data("quotebot").get("random_mode", "uniform")
+        if self.random_mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown random_mode {self.random_mode}")
+
+    def cog_unload(self):
+        self.bot.loop.create_task(close_webhook())
 
     @Cog.listener()
     async def on_message(self, message: Message):
@@ -87,12 +120,14 @@ class QuoteCog(PlopCog):
 
         self.message_count[message.channel.id] += 1
         if self.message_count[message.channel.id] == 31:
-            q = get_random_quote()
-            user = await self.get_user(q["quotee"])
-            if user is None:
-                user = q["quotee"]
-            await post_quote(message.channel, q["quote"], user)
             self.message_count[message.channel.id] = 0
+            q = quote_index.random_quote(mode=self.random_mode)
+            if q is None:
+                return
+            user = await self.get_user(q.quotee)
+            if user is None:
+                user = q.quotee
+            await post_quote(message.channel, q.quote, user)
 
     @command("add")
     async def add_quote(
@@ -106,14 +141,9 @@ class QuoteCog(PlopCog):
         if isinstance(user, User) or isinstance(user, Member):
             user_id = str(user.id)
 
-        quotes = get_value("quotebot", "quotes")
-        quote_dict = {
-            "quote": " ".join(quote),
-            "added_by": ctx.author.id,
-            "added_on": str(datetime.now()),
-        }
-        quotes.setdefault(user_id, []).append(quote_dict)
-        set_value("quotebot", "quotes", quotes)
+        quote_text = " ".join(quote)
+        await insert_quote(user_id, quote_text, ctx.author.id)
+        quote_index.add(user_id, quote_text)
         await post_message(ctx.channel, content="Quote added!")
 
     @command("random")
@@ -130,23 +160,22 @@ class QuoteCog(PlopCog):
             user_id = str(user.id)
             user_name = user.display_name
 
-        quotes = get_value("quotebot", "quotes")
-        try:
-            if user_id:
-                if user_id in quotes:
-                    quote = random.choice([q["quote"] for q in quotes[user_id]])
-                    await post_quote(ctx.channel, quote, user)
-                else:
-                    msg = "BEEP BOOP, 404 {} not found!".format(user_name)
-                    await post_message(ctx.channel, msg)
+        if user_id:
+            q = quote_index.random_quote(user_id)
+            if q is not None:
+                await post_quote(ctx.channel, q.quote, user)
             else:
-                q = get_random_quote()
-                user = await self.get_user(q["quotee"])
-                if user is None:
-                    user = q["quotee"]
-                await post_quote(ctx.channel, q["quote"], user)
-        except IndexError:
-            post_message(ctx.channel, "No quotes..")
+                msg = "BEEP BOOP, 404 {} not found!".format(user_name)
+                await post_message(ctx.channel, msg)
+        else:
+            q = quote_index.random_quote(mode=self.random_mode)
+            if q is None:
+                await post_message(ctx.channel, "No quotes..")
+                return
+            user = await self.get_user(q.quotee)
+            if user is None:
+                user = q.quotee
+            await post_quote(ctx.channel, q.quote, user)
 
     @command("list")
     async def list_quotes(self, ctx: Context, user: Union[Member, User, str]):
@@ -160,11 +189,11 @@ class QuoteCog(PlopCog):
             user_id = str(user.id)
             user_name = user.display_name
 
-        quotes = get_value("quotebot", "quotes")
+        quotes = await get_quotes(user_id)
 
-        if user_id in quotes:
+        if quotes:
             msg = f"{user_name}'s quotes are: "
-            msg += " | ".join([q["quote"] for q in quotes[user_id]])
+            msg += " | ".join(quotes)
         else:
             msg = f"Could not find {user_name} :(\nUse `!quotebot quotees` to list all users with a quote)"
         await post_message(ctx.channel, msg)
@@ -175,8 +204,7 @@ class QuoteCog(PlopCog):
         List all users with a quote in the database.
         This is triggered by a `!quotebot quotees` command.
         """
-        quotes = get_value("quotebot", "quotes")
-        names = [await self.get_user_name(user) for user in quotes.keys()]
+        names = await self.get_user_names(await get_quotees())
         msg = " | ".join(sorted(names))
         await post_message(ctx.channel, msg)
 
@@ -185,7 +213,7 @@ class QuoteCog(PlopCog):
         self, ctx: Context, user: Union[Member, User, str], *keywords: str
     ):
         """
-        Find quotes containing a given pattern.
+        Find quotes containing the given keywords, best matches first.
         This is triggered by a `!quotebot find <username> <keyword>` command.
         Pass * as the username to search through all quotes.
         """
@@ -196,21 +224,18 @@ class QuoteCog(PlopCog):
             user_id = str(user.id)
             user_name = user.display_name
 
-        all_quotes = get_value("quotebot", "quotes")
-
         messages: List[str] = []
 
-        if not search_all_users and user_id not in all_quotes:
+        if not search_all_users and not await has_quotee(user_id):
             messages.append(f"Could not find {user_name}")
         else:
             sentence = " ".join(keywords)
             found: Dict[str, List[str]] = defaultdict(list)
-            for quotee, quotes in all_quotes.items():
-                if not search_all_users and quotee != user_id:
-                    continue
-                for quote in quotes:
-                    if sentence.lower() in quote["quote"].lower():
-                        found[quotee].append(quote["quote"])
+            rows = await find_quotes(
+                sentence, None if search_all_users else user_id, FIND_MAX_QUOTES + 1
+            )
+            for row in rows:
+                found[row["quotee"]].append(row["quote"])
             if len(found) == 0:
                 if search_all_users:
                     messages.append(f"Could not find any occurence of '{sentence}'")
@@ -226,14 +251,14 @@ class QuoteCog(PlopCog):
                         await self.get_user(user) or user,
                     )
                     return
-                elif found_length > 25:
+                elif found_length > FIND_MAX_QUOTES:
                     messages.append(
-                        f"Found more than 25 quotes matching '{sentence}'. Skipping output."
+                        f"Found more than {FIND_MAX_QUOTES} quotes matching '{sentence}'. Skipping output."
                     )
                 else:
                     messages.append(f"Found these quotes containing '{sentence}':\n")
-                    for quotee, quotes in found.items():
-                        user_name = await self.get_user_name(quotee)
+                    user_names = await self.get_user_names(found.keys())
+                    for user_name, quotes in zip(user_names, found.values()):
                         messages.append(f"{user_name}: {' | '.join(quotes)}\n")
         for message in messages:
             await post_message(ctx.channel, message)
@@ -243,12 +268,12 @@ class QuoteCog(PlopCog):
         """
         Show the total quote count and a top 5 of users with most quotes
         """
-        quotes = get_value("quotebot", "quotes")
-        counter = Counter({quotee: len(quotes[quotee]) for quotee in quotes})
-        await post_message(ctx.channel, f"Total quote count: {sum(counter.values())}")
+        await post_message(ctx.channel, f"Total quote count: {await get_quote_count()}")
         msg = "Quote top 5:\n"
-        for quotee, num in counter.most_common(5):
-            msg += f"    {num}: {await self.get_user_name(quotee)}\n"
+        top_quotees = await get_top_quotees(5)
+        user_names = await self.get_user_names(row["quotee"] for row in top_quotees)
+        for row, user_name in zip(top_quotees, user_names):
+            msg += f"    {row['count']}: {user_name}\n"
         await post_message(ctx.channel, msg)
 
 
@@ -0,0 +1,185 @@
+import re
+from datetime import datetime
+from typing import List, Optional
+
+from api import db
+from api.utils import get_data
+
+
+def init_db():
+    """
+    Initialize the quote database with the Quote table if no existing table is found.
+    When the table is created, all quotes from the old `config/quotebot` file are migrated into it.
+    """
+    with db.transaction(immediate=True) as conn:
+        exists = conn.execute(
+            "SELECT COUNT(*) AS count FROM sqlite_master WHERE type='table' AND name='Quote';"
+        ).fetchone()["count"]
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS Quote("
+            "id INTEGER PRIMARY KEY,"
+            "quotee TEXT(64) NOT NULL,"
+            "quote TEXT NOT NULL,"
+            "added_by TEXT(64),"
+            "added_on TIMESTAMP);"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_quote_quotee ON Quote(quotee);")
+        if not exists:
+            migrate_config_quotes(conn)
+        init_search(conn)
+
+
+def init_search(conn):
+    """
+    Create the QuoteSearch full-text index over Quote.quote if it does not exist yet.
+    The index is kept up to date by triggers on the Quote table.
+    """
+    exists = conn.execute(
+        "SELECT COUNT(*) AS count FROM sqlite_master "
+        "WHERE type='table' AND name='QuoteSearch';"
+    ).fetchone()["count"]
+    conn.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS QuoteSearch USING fts5("
+        "quote, content='Quote', content_rowid='id', prefix='2 3');"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS quote_search_insert AFTER INSERT ON Quote BEGIN "
+        "INSERT INTO QuoteSearch(rowid, quote) VALUES (new.id, new.quote); END;"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS quote_search_delete AFTER DELETE ON Quote BEGIN "
+        "INSERT INTO QuoteSearch(QuoteSearch, rowid, quote) "
+        "VALUES ('delete', old.id, old.quote); END;"
+    )
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS quote_search_update AFTER UPDATE ON Quote BEGIN "
+        "INSERT INTO QuoteSearch(QuoteSearch, rowid, quote) "
+        "VALUES ('delete', old.id, old.quote); "
+        "INSERT INTO QuoteSearch(rowid, quote) VALUES (new.id, new.quote); END;"
+    )
+    if not exists:
+        conn.execute("INSERT INTO QuoteSearch(QuoteSearch) VALUES ('rebuild');")
+
+
+def migrate_config_quotes(conn):
+    """
+    Copy the quotes stored in the `quotes` key of `config/quotebot` into the Quote table.
+    The config file itself is left untouched.
+    """
+    quotes = get_data("quotebot").get("quotes", {})
+    conn.executemany(
+        "INSERT INTO Quote(quotee, quote, added_by, added_on) VALUES (?, ?, ?, ?)",
+        [
+            (
+                quotee,
+                quote["quote"],
+                str(quote["added_by"]) if quote.get("added_by") else None,
+                quote.get("added_on"),
+            )
+            for quotee, quote_list in quotes.items()
+            for quote in quote_list
+        ],
+    )
+
+
+@db.run_in_db_thread
+def insert_quote(quotee, quote, added_by):
+    conn = db.get_conn()
+    conn.execute(
+        "INSERT INTO Quote(quotee, quote, added_by, added_on) VALUES (?, ?, ?, ?)",
+        (quotee, quote, str(added_by), str(datetime.now())),
+    )
+
+
+@db.run_in_db_thread
+def has_quotee(quotee) -> bool:
+    conn = db.get_conn()
+    row = conn.execute(
+        "SELECT 1 FROM Quote WHERE quotee == ? LIMIT 1;", (quotee,)
+    ).fetchone()
+    return row is not None
+
+
+@db.run_in_db_thread
+def get_quotes(quotee) -> List[str]:
+    conn = db.get_conn()
+    quotes = [
+        row["quote"]
+        for row in conn.execute(
+            "SELECT quote FROM Quote WHERE quotee == ? ORDER BY id;", (quotee,)
+        ).fetchall()
+    ]
+    return quotes
+
+
+@db.run_in_db_thread
+def get_quotees() -> List[str]:
+    conn = db.get_conn()
+    quotees = [
+        row["quotee"]
+        for row in conn.execute("SELECT DISTINCT quotee FROM Quote;").fetchall()
+    ]
+    return quotees
+
+
+@db.timed
+def get_all_quotes():
+    conn = db.get_conn()
+    data = conn.execute("SELECT quotee, quote FROM Quote ORDER BY id;").fetchall()
+    return data
+
+
+@db.run_in_db_thread
+def find_quotes(
+    sentence: str, quotee: Optional[str] = None, limit: Optional[int] = None
+):
+    """
+    Return the quote rows (quotee, quote) matching the given sentence, best matches first,
+    at most `limit` of them if a limit is given.
+
+    Every word in the sentence has to occur in the quote, either fully or as a prefix of a word.
+    If the sentence contains no searchable words, a case insensitive substring search is done instead.
+    """
+    words = re.findall(r"\w+", sentence)
+    conn = db.get_conn()
+    if words:
+        query = (
+            "SELECT Quote.quotee, Quote.quote FROM QuoteSearch "
+            "INNER JOIN Quote ON Quote.id = QuoteSearch.rowid "
+            "WHERE QuoteSearch MATCH ?"
+        )
+        params = [" ".join(f'"{word}"*' for word in words)]
+        order = " ORDER BY QuoteSearch.rank"
+    else:
+        query = (
+            "SELECT quotee, quote FROM Quote WHERE instr(lower(quote), lower(?)) > 0"
+        )
+        params = [sentence]
+        order = " ORDER BY id"
+    if quotee is not None:
+        query += " AND quotee == ?"
+        params.append(quotee)
+    query += order
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    data = conn.execute(query + ";", params).fetchall()
+    return data
+
+
+@db.run_in_db_thread
+def get_quote_count() -> int:
+    conn = db.get_conn()
+    count = conn.execute("SELECT COUNT(*) AS count FROM Quote;").fetchone()["count"]
+    return count
+
+
+@db.run_in_db_thread
+def get_top_quotees(limit: int):
+    conn = db.get_conn()
+    data = conn.execute(
+        "SELECT quotee, COUNT(*) AS count FROM Quote "
+        "GROUP BY quotee ORDER BY count DESC LIMIT ?;",
+        (limit,),
+    ).fetchall()
+    return data
@@ -0,0 +1,119 @@
+"""
+In-memory index of all quotes.
+
+The index is loaded from the Quote table when the cogs using it are created,
+before the event loop handles any events, and has to be kept in sync
+by calling `add` whenever a quote is inserted.
+This assumes the bot process is the only one writing quotes,
+quotes inserted by another process are only seen after the index is reloaded.
+"""
+
+import random
+from typing import Dict, List, NamedTuple, Optional
+
+from .db import get_all_quotes
+
+SAMPLING_MODES = ("uniform", "quotee", "shuffle")
+
+
+def normalize_quote(quote: str) -> str:
+    """
+    Normalize quote text the way it is shown when posted, ignoring whitespace differences.
+    """
+    if quote.startswith("/tts"):
+        quote = quote[5:]
+    return " ".join(quote.split())
+
+
+class IndexedQuote(NamedTuple):
+    quotee: str
+    quote: str
+
+
+class QuoteIndex:
+    """
+    A flat list of all quotes together with the positions of the quotes of each quotee
+    and a lookup from normalized quote text to quotee.
+
+    Random quotes can be drawn in O(1) using one of the SAMPLING_MODES:
+        - uniform: every quote is equally likely
+        - quotee: every quotee is equally likely, followed by a uniform pick of their quotes
+        - shuffle: every quote is returned once before any quote is repeated
+    """
+
+    def __init__(self) -> None:
+        self.loaded = False
+        self.quotes: List[IndexedQuote] = []
+        self.by_quotee: Dict[str, List[int]] = {}
+        self.quotees: List[str] = []
+        self.by_text: Dict[str, str] = {}
+        # Lazy Fisher-Yates shuffle: positions before `cursor` were already drawn this round.
+        self.order: List[int] = []
+        self.cursor = 0
+
+    def load(self):
+        self.quotes = []
+        self.by_quotee = {}
+        self.quotees = []
+        self.by_text = {}
+        self.order = []
+        self.cursor = 0
+        for row in get_all_quotes():
+            self._add(row["quotee"], row["quote"])
+        self.loaded = True
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def add(self, quotee: str, quote: str):
+        self.ensure_loaded()
+        self._add(quotee, quote)
+
+    def _add(self, quotee: str, quote: str):
+        position = len(self.quotes)
+        self.quotes.append(IndexedQuote(quotee, quote))
+        if quotee not in self.by_quotee:
+            self.by_quotee[quotee] = []
+            self.quotees.append(quotee)
+        self.by_quotee[quotee].append(position)
+        self.by_text[normalize_quote(quote)] = quotee
+        self.order.append(position)
+
+    def find_quotee(self, quote: str) -> Optional[str]:
+        """
+        Return the quotee of the given quote text or None if the quote is unknown.
+        """
+        self.ensure_loaded()
+        return self.by_text.get(normalize_quote(quote))
+
+    def random_quote(
+        self, quotee: Optional[str] = None, mode: str = "uniform"
+    ) -> Optional[IndexedQuote]:
+        """
+        Return a random quote, optionally restricted to a single quotee.
+        Returns None if there are no matching quotes.
+        """
+        self.ensure_loaded()
+        if quotee is not None:
+            positions = self.by_quotee.get(quotee)
+            if not positions:
+                return None
+            return self.quotes[random.choice(positions)]
+        if not self.quotes:
+            return None
+        if mode == "quotee":
+            positions = self.by_quotee[random.choice(self.quotees)]
+            return self.quotes[random.choice(positions)]
+        if mode == "shuffle":
+            if self.cursor >= len(self.order):
+                self.cursor = 0
+            pick = random.randrange(self.cursor, len(self.order))
+            order = self.order
+            order[self.cursor], order[pick] = order[pick], order[self.cursor]
+            self.cursor += 1
+            return self.quotes[order[self.cursor - 1]]
+        return self.quotes[random.randrange(len(self.quotes))]
+
+
+quote_index = QuoteIndex()
@@ -0,0 +1,15 @@
+"""
+Plots of the plopkoek data.
+
+The plot modules depend on numpy and plotly, which are only imported once a plot is rendered,
+usually in a worker process, so importing this package stays cheap.
+"""
+
+
+def render_chord_diagram(*args, **kwargs):
+    """
+    See plots.plotly_chord.render_chord_diagram.
+    """
+    from .plotly_chord import render_chord_diagram
+
+    return render_chord_diagram(*args, **kwargs)
@@ -1,406 +1,326 @@
 # Source: https://plot.ly/python/filled-chord-diagram/
 # Modified by Darragh
+import importlib.util
 import random
+from typing import Dict, Hashable, Iterable, List, Tuple
 
 import numpy as np
-import pandas as pd
-from plotly.offline import download_plotlyjs, init_notebook_mode, iplot, plot
-from plotly.graph_objs import *
-import plotly.plotly as py
-
-from api import db
-
-
-def p():
-
-    conn = db.get_conn()
-
-    namecount = len(conn.execute(
-        "SELECT DISTINCT F1.name AS T FROM PlopkoekTransfer P1 INNER JOIN User F1 ON P1.user_from_id=F1.user_id GROUP BY P1.user_from_id "
-        "UNION "
-        "SELECT DISTINCT F2.name AS T FROM PlopkoekTransfer P2 INNER JOIN User F2 ON P2.user_to_id=F2.user_id GROUP BY P2.user_to_id").fetchall())
-
-    data = conn.execute("SELECT F.name AS fname, T.name AS tname, COUNT(*) AS count "
-                        "FROM PlopkoekTransfer P "
-                        "INNER JOIN User F ON P.user_from_id=F.user_id "
-                        "LEFT JOIN User T ON P.user_to_id=T.user_id "
-                        "WHERE F.name IS NOT NULL AND T.name IS NOT NULL "
-                        "GROUP BY P.user_from_id, P.user_to_id "
-                        "HAVING COUNT(*) > 2 "
-                        "ORDER BY P.user_from_id, P.user_to_id").fetchall()
-
-    usernames = []
-    fdata = []
-    for row in data:
-        fname = row['fname']
-        tname = row['tname']
-        if fname not in usernames:
-            usernames.append(fname)
-            findex = len(usernames) - 1
-            fdata.append([0] * namecount)
-        else:
-            findex = usernames.index(fname)
-        if tname not in usernames:
-            usernames.append(tname)
-            tindex = len(usernames) - 1
-            fdata.append([0] * namecount)
-        else:
-            tindex = usernames.index(tname)
-        fdata[tindex][findex] += row['count']
-
-    namecount = len(fdata)
-
-    # for i in range(namecount - len(fdata)):
-    #     fdata.append([0] * namecount)
-
-    for j, jj in enumerate(fdata):
-        if sum(jj) == 0:
-            fdata[j][j] = 2
-        fdata[j] = fdata[j][:namecount]
-
-    # matrix = np.array([[16, 3, 28, 0, 18],
-    #                    [18, 0, 12, 5, 29],
-    #                    [9, 11, 17, 27, 0],
-    #                    [19, 0, 31, 11, 12],
-    #                    [23, 17, 10, 0, 34]], dtype=int)
-    matrix = np.array(fdata, dtype=int)
-
-
-    def check_data(data_matrix):
-        L, M = data_matrix.shape
-        if L != M:
-            raise ValueError('Data array must have (n,n) shape')
-        return L
-
-
-    L = check_data(matrix)
-
-    PI = np.pi
-
-
-    def moduloAB(x, a, b):  # maps a real number onto the unit circle identified with
-        # the interval [a,b), b-a=2*PI
-        if a >= b:
-            raise ValueError('Incorrect interval ends')
-        y = (x - a) % (b - a)
-        return y + b if y < 0 else y + a
-
-
-    def test_2PI(x):
-        return 0 <= x < 2 * PI
-
-
-    row_sum = [np.sum(matrix[k, :]) for k in range(L)]
-
-    # set the gap between two consecutive ideograms
-    gap = 2 * PI * 0.005
-    ideogram_length = 2 * PI * np.asarray(row_sum) / sum(row_sum) - gap * np.ones(L)
-
-
-    def get_ideogram_ends(ideogram_len, gap):
-        ideo_ends = []
-        left = 0
-        for k in range(len(ideogram_len)):
-            right = left + ideogram_len[k]
-            ideo_ends.append([left, right])
-            left = right + gap
-        return ideo_ends
-
-
-    ideo_ends = get_ideogram_ends(ideogram_length, gap)
-    ideo_ends
-
-
-    def make_ideogram_arc(R, phi, a=50):
-        # R is the circle radius
-        # phi is the list of ends angle coordinates of an arc
-        # a is a parameter that controls the number of points to be evaluated on an arc
-        if not test_2PI(phi[0]) or not test_2PI(phi[1]):
-            phi = [moduloAB(t, 0, 2 * PI) for t in phi]
-        length = (phi[1] - phi[0]) % 2 * PI
-        nr = 5 if length <= PI / 4 else int(a * length / PI)
+import plotly.graph_objs as go
+import plotly.io as pio
+
+PI = np.pi
+# The gap between two consecutive ideograms,
+# smaller when there are so many ideograms that the gaps would take up more than half of the circle.
+GAP = 2 * PI * 0.005
+
+
+def build_transfer_matrix(rows) -> Tuple[np.ndarray, List[Hashable]]:
+    """
+    Build the chord diagram matrix from (from user, to user, count) rows in a single pass.
+    matrix[i, j] is the number of plopkoeks user j gave to user i.
+    Users that didn't receive anything get a small self relation so their row isn't empty.
+    Returns the matrix and the users in matrix order.
+    """
+    index: Dict[Hashable, int] = {}
+    to_index: List[int] = []
+    from_index: List[int] = []
+    counts: List[int] = []
+    for fname, tname, count in rows:
+        from_index.append(index.setdefault(fname, len(index)))
+        to_index.append(index.setdefault(tname, len(index)))
+        counts.append(count)
+
+    matrix = np.zeros((len(index), len(index)), dtype=int)
+    np.add.at(matrix, (to_index, from_index), counts)
+    empty = np.flatnonzero(matrix.sum(axis=1) == 0)
+    matrix[empty, empty] = 2
+    return matrix, list(index)
+
+
+def modulo_ab(x, a, b):
+    """
+    Map angles onto the interval [a, b), with b - a = 2 * PI.
+    """
+    if a >= b:
+        raise ValueError("Incorrect interval ends")
+    return (np.asarray(x) - a) % (b - a) + a
+
+
+def in_2pi(x):
+    x = np.asarray(x)
+    return (0 <= x) & (x < 2 * PI)
+
+
+def get_ideogram_ends(matrix: np.ndarray, gap: float = GAP) -> np.ndarray:
+    """
+    Return the (start, end) angles of the ideogram of every user as an (L, 2) array.
+    The circle without the gaps is divided over the ideograms proportional to their row sums,
+    so every user with a non-empty row gets an ideogram with a positive length.
+    """
+    row_sum = matrix.sum(axis=1)
+    gap = min(gap, PI / len(matrix))
+    lengths = (2 * PI - len(matrix) * gap) * row_sum / row_sum.sum()
+    starts = np.concatenate(([0.0], np.cumsum(lengths + gap)[:-1]))
+    return np.column_stack((starts, starts + lengths))
+
+
+def get_ribbon_ends(
+    matrix: np.ndarray, ideo_ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split every ideogram into the ends of its ribbons, ordered by ribbon size.
+
+    Returns an (L, L, 2) array with the (start, end) angles of the ribbon ends in every ideogram
+    and an (L, L) array with the position of the ribbon to user j in the ideogram of user k.
+    """
+    row_sum = matrix.sum(axis=1)
+    ideogram_length = ideo_ends[:, 1] - ideo_ends[:, 0]
+    mapped = matrix * (ideogram_length / row_sum)[:, None]
+    idx_sort = np.argsort(mapped, axis=1)
+    sorted_mapped = np.take_along_axis(mapped, idx_sort, axis=1)
+    boundary = ideo_ends[:, :1] + np.concatenate(
+        (np.zeros((len(matrix), 1)), np.cumsum(sorted_mapped, axis=1)), axis=1
+    )
+    ribbon_ends = np.stack((boundary[:, :-1], boundary[:, 1:]), axis=2)
+    return ribbon_ends, np.argsort(idx_sort, axis=1)
+
+
+def batch_linspace(start: np.ndarray, stop: np.ndarray, num: np.ndarray):
+    """
+    Evaluate np.linspace(start[i], stop[i], num[i]) for all i at once.
+    Returns the concatenated values and the offsets at which every range starts.
+    """
+    offsets = np.cumsum(num) - num
+    range_index = np.repeat(np.arange(len(num)), num)
+    k = np.arange(num.sum()) - offsets[range_index]
+    step = (stop - start) / np.maximum(num - 1, 1)
+    return start[range_index] + step[range_index] * k, offsets
+
+
+def format_points(points: np.ndarray, fmt: str) -> List[str]:
+    return [
+        fmt.format(x, y) for x, y in zip(points.real.tolist(), points.imag.tolist())
+    ]
+
+
+def get_ideogram_arcs(ideo_ends: np.ndarray, a: int = 50) -> List[np.ndarray]:
+    """
+    Return the points on the unit circle of every ideogram arc.
+    `a` controls the number of points that are evaluated on an arc.
+    """
+    phi = modulo_ab(ideo_ends, 0, 2 * PI)
+    length = (phi[:, 1] - phi[:, 0]) % 2 * PI
+    nr = np.where(length <= PI / 4, 5, (a * length / PI).astype(int))
+    phi = np.where((phi[:, 0] < phi[:, 1])[:, None], phi, modulo_ab(phi, -PI, PI))
+    theta, offsets = batch_linspace(phi[:, 0], phi[:, 1], nr)
+    return np.split(np.exp(1j * theta), offsets[1:])
+
+
+def get_ideogram_path(outer: np.ndarray, inner: np.ndarray) -> str:
+    """
+    Return the SVG path of the ideogram shape between the outer and inner arc.
+    """
+    points = format_points(np.concatenate((outer, inner[::-1])), "{}, {}")
+    return "M " + " L ".join(points) + f" L {outer.real[0]} ,{outer.imag[0]}"
+
+
+def get_ribbon_arc_paths(theta0, theta1) -> List[str]:
+    """
+    Return the SVG path segments of the arcs from theta0[i] to theta1[i] on the unit circle.
+    """
+    theta0 = np.asarray(theta0, dtype=float)
+    theta1 = np.asarray(theta1, dtype=float)
+    if not (in_2pi(theta0) & in_2pi(theta1)).all():
+        raise ValueError(
+            "the angle coordinates for an arc side of a ribbon must be in [0, 2*pi]"
+        )
+    swap = theta0 < theta1
+    theta0 = np.where(swap, modulo_ab(theta0, -PI, PI), theta0)
+    theta1 = np.where(swap, modulo_ab(theta1, -PI, PI), theta1)
+    if (swap & (theta0 * theta1 > 0)).any():
+        raise ValueError("incorrect angle coordinates for ribbon")
+
+    nr = np.maximum((40 * (theta0 - theta1) / PI).astype(int), 3)
+    theta, offsets = batch_linspace(theta0, theta1, nr)
+    points = format_points(np.exp(1j * theta), "L {}, {} ")
+    bounds = np.append(offsets, len(points)).tolist()
+    return ["".join(points[s:e]) for s, e in zip(bounds[:-1], bounds[1:])]
+
+
+def get_q_bezier_paths(angles: np.ndarray, radius) -> List[str]:
+    """
+    Return the SVG paths of the quadratic Bezier curves with the given (n, 3) control point angles.
+    The middle control point is placed at `radius` from the origin.
+    """
+    points = np.exp(1j * np.asarray(angles, dtype=float))
+    points[:, 1] *= radius
+    return [
+        f"M {a.real},{a.imag} Q {b.real}, {b.imag} {c.real}, {c.imag}"
+        for a, b, c in points.tolist()
+    ]
+
+
+def make_layout(title, plot_size, shapes):
+    axis = dict(
+        showline=False,  # hide axis line, grid, ticklabels and  title
+        zeroline=False,
+        showgrid=False,
+        showticklabels=False,
+        title="",
+    )
+
+    return go.Layout(
+        title=title,
+        xaxis=axis,
+        yaxis=axis,
+        showlegend=False,
+        width=plot_size,
+        height=plot_size,
+        margin=dict(t=25, b=25, l=25, r=25),
+        hovermode="closest",
+        shapes=shapes,  # the dicts defining the ribbon, respectively the ideogram shapes
+    )
+
+
+def make_shape(path, line_color, fill_color, width=0.5):
+    # line_color is the color of the shape boundary
+    # fill_color is the color assigned to the shape
+    return dict(
+        line=dict(color=line_color, width=width),
+        path=path,
+        type="path",
+        fillcolor=fill_color,
+    )
+
+
+def make_marker(z, color, text):
+    # the text will be displayed when hovering the mouse over the marker
+    return go.Scatter(
+        x=[z.real],
+        y=[z.imag],
+        mode="markers",
+        marker=dict(size=0.5, color=color),
+        text=text,
+        hoverinfo="text",
+    )
+
+
+def make_figure(matrix: np.ndarray, labels: List[str], title: str) -> go.Figure:
+    """
+    Build the chord diagram figure of the given transfer matrix.
+    """
+    L = len(labels)
+    row_sum = matrix.sum(axis=1)
 
-        if phi[0] < phi[1]:
-            theta = np.linspace(phi[0], phi[1], nr)
-        else:
-            phi = [moduloAB(t, -PI, PI) for t in phi]
-            theta = np.linspace(phi[0], phi[1], nr)
-        return R * np.exp(1j * theta)
-
-
-    # labels = ['Emma', 'Isabella', 'Ava', 'Olivia', 'Sophia']
-    labels = usernames
-    # ideo_colors = ['rgba(244, 109, 67, 0.75)',
-    #                'rgba(253, 174, 97, 0.75)',
-    #                'rgba(254, 224, 139, 0.75)',
-    #                'rgba(217, 239, 139, 0.75)',
-    #                'rgba(166, 217, 106, 0.75)']  # brewer colors with alpha set on 0.75
     ideo_colors = []
-    for _ in range(namecount):
+    for _ in range(L):
         _r = (random.randrange(0, 256) + 128) // 2
         _g = (random.randrange(0, 256) + 128) // 2
         _b = (random.randrange(0, 256) + 128) // 2
-        ideo_colors.append('rgba({}, {}, {}, 0.75)'.format(_r, _g, _b))
-
-
-    def map_data(data_matrix, row_value, ideogram_length):
-        mapped = np.zeros(data_matrix.shape)
-        for j in range(L):
-            mapped[:, j] = ideogram_length * data_matrix[:, j] / row_value
-        return mapped
-
-
-    mapped_data = map_data(matrix, row_sum, ideogram_length)
-
-    idx_sort = np.argsort(mapped_data, axis=1)
-
+        ideo_colors.append("rgba({}, {}, {}, 0.75)".format(_r, _g, _b))
 
-    def make_ribbon_ends(mapped_data, ideo_ends, idx_sort):
-        L = mapped_data.shape[0]
-        ribbon_boundary = np.zeros((L, L + 1))
-        for k in range(L):
-            start = ideo_ends[k][0]
-            ribbon_boundary[k][0] = start
-            for j in range(1, L + 1):
-                J = idx_sort[k][j - 1]
-                ribbon_boundary[k][j] = start + mapped_data[k][J]
-                start = ribbon_boundary[k][j]
-        return [[(ribbon_boundary[k][j], ribbon_boundary[k][j + 1]) for j in range(L)] for k in range(L)]
+    ideo_ends = get_ideogram_ends(matrix)
+    ribbon_ends, ribbon_pos = get_ribbon_ends(matrix, ideo_ends)
 
+    shapes = []
 
-    ribbon_ends = make_ribbon_ends(mapped_data, ideo_ends, idx_sort)
-
-
-    def control_pts(angle, radius):
-        # angle is a  3-list containing angular coordinates of the control points b0, b1, b2
-        # radius is the distance from b1 to the  origin O(0,0)
-
-        if len(angle) != 3:
-            raise ValueError('angle must have len =3')
-        b_cplx = np.array([np.exp(1j * angle[k]) for k in range(3)])
-        b_cplx[1] = radius * b_cplx[1]
-        return list(zip(b_cplx.real, b_cplx.imag))
-
-
-    def ctrl_rib_chords(l, r, radius):
-        # this function returns a 2-list containing control poligons of the two quadratic Bezier
-        # curves that are opposite sides in a ribbon
-        # l (r) the list of angular variables of the ribbon arc ends defining
-        # the ribbon starting (ending) arc
-        # radius is a common parameter for both control polygons
-        if len(l) != 2 or len(r) != 2:
-            raise ValueError('the arc ends must be elements in a list of len 2')
-        return [control_pts([l[j], (l[j] + r[j]) / 2, r[j]], radius) for j in range(2)]
-
-
-    ribbon_color = [L * [ideo_colors[k]] for k in range(L)]
-    # ribbon_color[0][4] = ideo_colors[4]
-    # ribbon_color[1][2] = ideo_colors[2]
-    # ribbon_color[2][3] = ideo_colors[3]
-    # ribbon_color[2][4] = ideo_colors[4]
-
-
-    def make_q_bezier(b):  # defines the Plotly SVG path for a quadratic Bezier curve defined by the
-
-        if len(b) != 3:
-            raise ValueError('control poligon must have 3 points')
-        A, B, C = b
-        return 'M ' + str(A[0]) + ',' + str(A[1]) + ' ' + 'Q ' + \
-               str(B[0]) + ', ' + str(B[1]) + ' ' + \
-               str(C[0]) + ', ' + str(C[1])
-
-
-    b = [(1, 4), (-0.5, 2.35), (3.745, 1.47)]
-
-    make_q_bezier(b)
-
-
-    def make_ribbon_arc(theta0, theta1):
-        if test_2PI(theta0) and test_2PI(theta1):
-            if theta0 < theta1:
-                theta0 = moduloAB(theta0, -PI, PI)
-                theta1 = moduloAB(theta1, -PI, PI)
-                if theta0 * theta1 > 0:
-                    raise ValueError('incorrect angle coordinates for ribbon')
-
-            nr = int(40 * (theta0 - theta1) / PI)
-            if nr <= 2: nr = 3
-            theta = np.linspace(theta0, theta1, nr)
-            pts = np.exp(1j * theta)  # points on arc in polar complex form
-
-            string_arc = ''
-            for k in range(len(theta)):
-                string_arc += 'L ' + str(pts.real[k]) + ', ' + str(pts.imag[k]) + ' '
-            return string_arc
+    # Collect the geometry of all ribbons first, so all paths can be computed at once.
+    self_rels = []  # (k, l)
+    ribbons = []  # (k, j, l, r)
+    for k, j in zip(*np.nonzero(np.triu(matrix + matrix.T))):
+        l = ribbon_ends[k, ribbon_pos[k, j]]
+        if j == k:
+            self_rels.append((k, l))
         else:
-            raise ValueError('the angle coordinates for an arc side of a ribbon must be in [0, 2*pi]')
-
-
-    make_ribbon_arc(np.pi / 3, np.pi / 6)
-
-
-    def make_layout(title, plot_size):
-        axis = dict(showline=False,  # hide axis line, grid, ticklabels and  title
-                    zeroline=False,
-                    showgrid=False,
-                    showticklabels=False,
-                    title=''
-                    )
-
-        return Layout(title=title,
-                      xaxis=XAxis(axis),
-                      yaxis=YAxis(axis),
-                      showlegend=False,
-                      width=plot_size,
-                      height=plot_size,
-                      margin=Margin(t=25, b=25, l=25, r=25),
-                      hovermode='closest',
-                      shapes=[]  # to this list one appends below the dicts defining the ribbon,
-                      # respectively the ideogram shapes
-                      )
-
-
-    def make_ideo_shape(path, line_color, fill_color):
-        # line_color is the color of the shape boundary
-        # fill_collor is the color assigned to an ideogram
-        return dict(
-            line=Line(
-                color=line_color,
-                width=0.45
-            ),
-
-            path=path,
-            type='path',
-            fillcolor=fill_color,
-        )
+            ribbons.append((k, j, l, ribbon_ends[j, ribbon_pos[j, k]]))
+
+    self_ls = np.array([l for _, l in self_rels]).reshape(-1, 2)
+    self_beziers = get_q_bezier_paths(
+        np.column_stack((self_ls[:, 0], self_ls.mean(axis=1), self_ls[:, 1])), 0.35
+    )
+    self_arcs = get_ribbon_arc_paths(self_ls[:, 1], self_ls[:, 0])
+
+    rib_ls = np.array([l for _, _, l, _ in ribbons]).reshape(-1, 2)
+    # The r ends are reversed, otherwise you get a twisted ribbon.
+    rib_rs = np.array([r for _, _, _, r in ribbons]).reshape(-1, 2)[:, ::-1]
+    rib_beziers = get_q_bezier_paths(
+        np.concatenate(
+            (
+                np.column_stack(
+                    (rib_ls[:, 0], (rib_ls[:, 0] + rib_rs[:, 0]) / 2, rib_rs[:, 0])
+                ),
+                np.column_stack(
+                    (rib_rs[:, 1], (rib_ls[:, 1] + rib_rs[:, 1]) / 2, rib_ls[:, 1])
+                ),
+            )
+        ),
+        0.2,
+    )
+    rib_arcs = get_ribbon_arc_paths(
+        np.concatenate((rib_rs[:, 0], rib_ls[:, 1])),
+        np.concatenate((rib_rs[:, 1], rib_ls[:, 0])),
+    )
 
-
-    def make_ribbon(l, r, line_color, fill_color, radius=0.2):
-        # l=[l[0], l[1]], r=[r[0], r[1]]  represent the opposite arcs in the ribbon
-        # line_color is the color of the shape boundary
-        # fill_color is the fill color for the ribbon shape
-        poligon = ctrl_rib_chords(l, r, radius)
-        b, c = poligon
-
-        return dict(
-            line=Line(
-                color=line_color, width=0.5
-            ),
-            path=make_q_bezier(b) + make_ribbon_arc(r[0], r[1]) +
-                 make_q_bezier(c[::-1]) + make_ribbon_arc(l[1], l[0]),
-            type='path',
-            fillcolor=fill_color,
+    ribbon_info = []
+    for i, (k, l) in enumerate(self_rels):
+        shapes.append(
+            make_shape(
+                self_beziers[i] + self_arcs[i], "rgb(175,175,175)", ideo_colors[k]
+            )
         )
+        z = 0.9 * np.exp(1j * (l[0] + l[1]) / 2)
+        text = f"{labels[k]} gaf zichzelf {matrix[k][k]:d} plopkoeken."
+        ribbon_info.append(make_marker(z, ideo_colors[k], text))
+
+    n = len(ribbons)
+    for i, (k, j, l, r) in enumerate(ribbons):
+        zi = 0.9 * np.exp(1j * (l[0] + l[1]) / 2)
+        zf = 0.9 * np.exp(1j * (r[0] + r[1]) / 2)
+        # texti and textf are the strings that will be displayed when hovering the mouse
+        # over the two ribbon ends
+        texti = f"{labels[k]} gaf {labels[j]} {matrix[j][k]:d} plopkoeken."
+        textf = f"{labels[j]} gaf {labels[k]} {matrix[k][j]:d} plopkoeken."
+        ribbon_info.append(make_marker(zi, ideo_colors[k], texti))
+        ribbon_info.append(make_marker(zf, ideo_colors[k], textf))
+        path = rib_beziers[i] + rib_arcs[i] + rib_beziers[n + i] + rib_arcs[n + i]
+        shapes.append(make_shape(path, "rgb(175,175,175)", ideo_colors[k]))
 
-
-    def make_self_rel(l, line_color, fill_color, radius):
-        # radius is the radius of Bezier control point b_1
-        b = control_pts([l[0], (l[0] + l[1]) / 2, l[1]], radius)
-        return dict(
-            line=Line(
-                color=line_color, width=0.5
-            ),
-            path=make_q_bezier(b) + make_ribbon_arc(l[1], l[0]),
-            type='path',
-            fillcolor=fill_color,
+    ideograms = []
+    for k, arc in enumerate(get_ideogram_arcs(ideo_ends)):
+        z = 1.1 * arc
+        ideograms.append(
+            go.Scatter(
+                x=z.real,
+                y=z.imag,
+                mode="lines",
+                line=dict(color=ideo_colors[k], shape="spline", width=0.25),
+                text=labels[k] + "<br>" + "{:d}".format(row_sum[k]),
+                hoverinfo="text",
+            )
+        )
+        shapes.append(
+            make_shape(
+                get_ideogram_path(z, arc), "rgb(150,150,150)", ideo_colors[k], 0.45
+            )
         )
 
-
-    def invPerm(perm):
-        # function that returns the inverse of a permutation, perm
-        inv = [0] * len(perm)
-        for i, s in enumerate(perm):
-            inv[s] = i
-        return inv
-
-
-    layout = make_layout('Chord diagram', 1000)
-
-    radii_sribb = [0.4, 0.30, 0.35, 0.39, 0.12]  # these value are set after a few trials
-
-    ribbon_info = []
-    for k in range(L):
-
-        sigma = idx_sort[k]
-        sigma_inv = invPerm(sigma)
-        for j in range(k, L):
-            if matrix[k][j] == 0 and matrix[j][k] == 0: continue
-            eta = idx_sort[j]
-            eta_inv = invPerm(eta)
-            l = ribbon_ends[k][sigma_inv[j]]
-
-            if j == k:
-                layout['shapes'].append(make_self_rel(l, 'rgb(175,175,175)',
-                                                      ideo_colors[k], radius=0.35))
-                z = 0.9 * np.exp(1j * (l[0] + l[1]) / 2)
-                # the text below will be displayed when hovering the mouse over the ribbon
-                text = labels[k] + ' commented on ' + '{:d}'.format(matrix[k][k]) + ' of ' + 'shit Fb posts',
-                ribbon_info.append(Scatter(x=z.real,
-                                           y=z.imag,
-                                           mode='markers',
-                                           marker=Marker(size=0.5, color=ideo_colors[k]),
-                                           text=text,
-                                           hoverinfo='text'
-                                           )
-                                   )
-            else:
-                r = ribbon_ends[j][eta_inv[k]]
-                zi = 0.9 * np.exp(1j * (l[0] + l[1]) / 2)
-                zf = 0.9 * np.exp(1j * (r[0] + r[1]) / 2)
-                # texti and textf are the strings that will be displayed when hovering the mouse
-                # over the two ribbon ends
-                texti = labels[k] + ' gaf ' + labels[j] + ' {:d}'.format(matrix[k][j]) + ' plopkoeken.'
-
-                textf = labels[j] + ' gaf ' + labels[k] + ' {:d}'.format(matrix[k][j]) + ' plopkoeken.'
-                ribbon_info.append(Scatter(x=zi.real,
-                                           y=zi.imag,
-                                           mode='markers',
-                                           marker=Marker(size=0.5, color=ribbon_color[k][j]),
-                                           text=texti,
-                                           hoverinfo='text'
-                                           )
-                                   ),
-                ribbon_info.append(Scatter(x=zf.real,
-                                           y=zf.imag,
-                                           mode='markers',
-                                           marker=Marker(size=0.5, color=ribbon_color[k][j]),
-                                           text=textf,
-                                           hoverinfo='text'
-                                           )
-                                   )
-                r = (r[1], r[0])  # IMPORTANT!!!  Reverse these arc ends because otherwise you get
-                # a twisted ribbon
-                # append the ribbon shape
-                layout['shapes'].append(make_ribbon(l, r, 'rgb(175,175,175)', ribbon_color[k][j]))
-
-    ideograms = []
-    for k in range(len(ideo_ends)):
-        z = make_ideogram_arc(1.1, ideo_ends[k])
-        zi = make_ideogram_arc(1.0, ideo_ends[k])
-        m = len(z)
-        n = len(zi)
-        ideograms.append(Scatter(x=z.real,
-                                 y=z.imag,
-                                 mode='lines',
-                                 line=Line(color=ideo_colors[k], shape='spline', width=0.25),
-                                 text=labels[k] + '<br>' + '{:d}'.format(row_sum[k]),
-                                 hoverinfo='text'
-                                 )
-                         )
-
-        path = 'M '
-        for s in range(m):
-            path += str(z.real[s]) + ', ' + str(z.imag[s]) + ' L '
-
-        Zi = np.array(zi.tolist()[::-1])
-
-        for s in range(m):
-            path += str(Zi.real[s]) + ', ' + str(Zi.imag[s]) + ' L '
-        path += str(z.real[0]) + ' ,' + str(z.imag[0])
-
-        layout['shapes'].append(make_ideo_shape(path, 'rgb(150,150,150)', ideo_colors[k]))
-
-    data = Data(ideograms + ribbon_info)
-    fig = Figure(data=data, layout=layout)
-
-    url = plot(fig, filename='chord-diagram-Fb', auto_open=False)
+    return go.Figure(
+        data=ideograms + ribbon_info, layout=make_layout(title, 1000, shapes)
+    )
+
+
+def render_chord_diagram(
+    rows: Iterable[Tuple[str, str, int]], names: Dict[str, str], title: str
+) -> Tuple[bytes, str]:
+    """
+    Render the chord diagram of the given (from user id, to user id, count) rows.
+    `names` maps the user ids to the labels shown in the diagram.
+
+    Returns the rendered file and its extension.
+    The diagram is rendered as PNG if kaleido is installed and as HTML otherwise.
+    """
+    matrix, users = build_transfer_matrix(rows)
+    fig = make_figure(matrix, [names.get(user, user) for user in users], title)
+    if importlib.util.find_spec("kaleido") is not None:
+        return pio.to_image(fig, format="png"), "png"
+    return pio.to_html(fig, include_plotlyjs="cdn").encode(), "html"
@@ -0,0 +1,11 @@
+"""
+The tests run against the throwaway bench workspace, so the real config files
+and plopkoek.db are never touched. It is set up before any cog is imported.
+"""
+
+import tempfile
+
+from bench.workspace import setup_workspace
+
+_workspace = tempfile.TemporaryDirectory(prefix="plopkoek-tests-")
+setup_workspace(_workspace.name)
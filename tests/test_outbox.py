@@ -0,0 +1,29 @@
+from collections import deque
+
+from discord.embeds import Embed
+
+from api.outbox import MAX_MESSAGE_LENGTH, _Outgoing, coalesce
+
+
+def donation(i: int) -> _Outgoing:
+    embed = Embed(description=f"message {i}")
+    embed.set_author(name="receiver")
+    return _Outgoing(f"Je hebt een plopkoek gekregen! ({i})", embed)
+
+
+def test_messages_with_embeds_are_merged():
+    queue = deque(donation(i) for i in range(3))
+    message = coalesce(queue)
+    assert not queue
+    assert message.embed is None
+    assert message.content == "\n".join(
+        f"Je hebt een plopkoek gekregen! ({i})\n> **receiver**\n> message {i}"
+        for i in range(3)
+    )
+
+
+def test_a_single_message_keeps_its_embed():
+    first = donation(0)
+    queue = deque([first, _Outgoing("x" * MAX_MESSAGE_LENGTH, None)])
+    assert coalesce(queue) is first
+    assert len(queue) == 1
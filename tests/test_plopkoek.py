@@ -0,0 +1,70 @@
+import asyncio
+
+import cogs.plopkoek
+from api.outbox import outbox
+from bench.fake import BenchBot, World
+
+OWNER = 0
+MEMBER = 1
+
+
+def run_command(content: str, author: int):
+    """
+    Run a command as the given user of a fresh world with a PlopkoekCog,
+    return the bot and the routes of the API calls it made.
+    """
+
+    async def run():
+        from api.manager import prefixes
+
+        world = World(2)
+        bot = BenchBot(
+            world,
+            0,
+            command_prefix=prefixes,
+            owner_id=world.user_ids[OWNER],
+            loop=asyncio.get_running_loop(),
+        )
+        cogs.plopkoek.setup(bot)
+        await bot.feed(
+            "message_create",
+            world.message_payload(
+                world.channel_ids[0], world.user_ids[author], content
+            ),
+        )
+        await outbox.drain()
+        return bot
+
+    return asyncio.run(run())
+
+
+def test_rebuild_is_refused_for_non_owners(monkeypatch):
+    rebuilds = []
+
+    async def rebuild_counters():
+        rebuilds.append(True)
+
+    monkeypatch.setattr(cogs.plopkoek, "rebuild_counters", rebuild_counters)
+
+    bot = run_command("!pk rebuild", MEMBER)
+    assert not rebuilds
+    assert bot.errors["command rebuild"] == 1
+    assert not bot.http.calls
+
+    bot = run_command("!pk rebuild", OWNER)
+    assert rebuilds
+    assert not bot.errors
+    assert bot.http.calls["POST /channels/{channel_id}/messages"] == 1
+
+
+def test_leaderboard_pages_past_the_end_show_the_last_page():
+    bot = run_command(f"!pk grandleaders {10 ** 30}", MEMBER)
+    assert not bot.errors
+    cog = bot.get_cog("PlopkoekCog")
+    assert list(cog.leaderboards.data) == [(cogs.plopkoek.ALLTIME, 1)]
+
+
+def test_graph_of_an_invalid_year_replies_with_no_data():
+    bot = run_command("!pk graph 12 9999", MEMBER)
+    assert not bot.errors
+    assert bot.http.calls["POST /channels/{channel_id}/messages"] == 1
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import pytest
+
+from api import db
+from cogs.plopkoek.db import (
+    DAILY_DONATIONS,
+    donate_plopkoek,
+    get_month_key,
+    init_db,
+    undonate_plopkoek,
+)
+
+DONATOR = "1"
+RECEIVER = "2"
+CHANNEL = "3"
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    """
+    A connection to an empty database, used by the blocking versions of the DB functions.
+    """
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "plopkoek.db"))
+    monkeypatch.setattr(db._local, "conn", None, raising=False)
+    yield db.get_conn()
+    db.get_conn().close()
+
+
+def counters(conn, user_id):
+    """
+    The (received, donated) counters of the user for this month and for all time.
+    """
+    monthly = conn.execute(
+        "SELECT received, donated FROM PlopkoekMonthly WHERE user_id == ? AND month == ?;",
+        (user_id, get_month_key()),
+    ).fetchone()
+    total = conn.execute(
+        "SELECT received, donated FROM PlopkoekTotal WHERE user_id == ?;", (user_id,)
+    ).fetchone()
+    return tuple(monthly), tuple(total)
+
+
+def test_donations_are_refused_when_the_daily_quota_is_used(conn):
+    init_db()
+    for i in range(DAILY_DONATIONS):
+        result = donate_plopkoek.__wrapped__(DONATOR, RECEIVER, CHANNEL, str(i))
+        assert result == (i + 1, DAILY_DONATIONS - i - 1)
+    assert donate_plopkoek.__wrapped__(DONATOR, RECEIVER, CHANNEL, "6") is None
+    assert counters(conn, RECEIVER) == ((DAILY_DONATIONS, 0), (DAILY_DONATIONS, 0))
+
+
+def test_removal_restores_the_quota_and_the_counters(conn):
+    init_db()
+    donate_plopkoek.__wrapped__(DONATOR, RECEIVER, CHANNEL, "1")
+    donate_plopkoek.__wrapped__(DONATOR, RECEIVER, CHANNEL, "2")
+
+    result = undonate_plopkoek.__wrapped__(DONATOR, RECEIVER, CHANNEL, "1")
+    assert result == (1, DAILY_DONATIONS - 1, {get_month_key()})
+    assert counters(conn, RECEIVER) == ((1, 0), (1, 0))
+    assert counters(conn, DONATOR) == ((0, 1), (0, 1))
+    assert undonate_plopkoek.__wrapped__(DONATOR, RECEIVER, CHANNEL, "1") is None
+
+
+def test_init_db_fills_the_counters_of_an_old_database(conn):
+    conn.execute(
+        "CREATE TABLE PlopkoekTransfer("
+        "user_from_id TEXT(64) NOT NULL,"
+        "user_to_id TEXT(64) NOT NULL,"
+        "channel_id TEXT(64) NOT NULL,"
+        "message_id TEXT(64) NOT NULL,"
+        "dt TIMESTAMP NOT NULL);"
+    )
+    now = datetime.now()
+    old = datetime(2019, 5, 4, 12)
+    conn.executemany(
+        "INSERT INTO PlopkoekTransfer VALUES (?, ?, ?, ?, ?);",
+        [
+            (DONATOR, RECEIVER, CHANNEL, "1", now),
+            (DONATOR, RECEIVER, CHANNEL, "2", now),
+            (RECEIVER, DONATOR, CHANNEL, "3", now),
+            (DONATOR, RECEIVER, CHANNEL, "4", old),
+        ],
+    )
+    init_db()
+
+    assert counters(conn, RECEIVER) == ((2, 1), (3, 1))
+    assert counters(conn, DONATOR) == ((1, 2), (1, 3))
+    old_month = conn.execute(
+        "SELECT user_id, received, donated FROM PlopkoekMonthly WHERE month == ? "
+        "ORDER BY user_id;",
+        (get_month_key("5", "2019"),),
+    ).fetchall()
+    assert [tuple(row) for row in old_month] == [(DONATOR, 0, 1), (RECEIVER, 1, 0)]
+
+
+@pytest.mark.parametrize(
+    "month, year", [("12", "9999"), ("1", "0"), ("3", "-5"), ("1", "10000"), ("13", "")]
+)
+def test_months_without_bounds_have_no_key(month, year):
+    assert get_month_key(month, year) is None
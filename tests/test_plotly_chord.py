@@ -0,0 +1,35 @@
+import numpy as np
+
+from plots.plotly_chord import (
+    build_transfer_matrix,
+    get_ideogram_ends,
+    render_chord_diagram,
+)
+
+
+def skewed_rows(users: int, transfers: int):
+    """
+    (from user, to user, count) rows where a few users give and receive most plopkoeks.
+    """
+    rng = np.random.default_rng(1)
+    activity = 1 / np.arange(1, users + 1) ** 1.1
+    pairs = rng.choice(users, (transfers, 2), p=activity / activity.sum())
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    keys, counts = np.unique(pairs, axis=0, return_counts=True)
+    return [(int(f), int(t), int(c)) for (f, t), c in zip(keys, counts)]
+
+
+def test_every_ideogram_has_a_positive_length():
+    matrix, _ = build_transfer_matrix(skewed_rows(200, 3000))
+    ends = get_ideogram_ends(matrix)
+    assert (ends[:, 1] > ends[:, 0]).all()
+    assert (ends[1:, 0] > ends[:-1, 1]).all()
+    assert ends[-1, 1] < 2 * np.pi
+
+
+def test_render_skewed_matrix():
+    rows = skewed_rows(200, 3000)
+    names = {user: f"user{user}" for row in rows for user in row[:2]}
+    content, extension = render_chord_diagram(rows, names, "Plopkoeken")
+    assert content
+    assert extension in ("png", "html")